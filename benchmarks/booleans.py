@@ -0,0 +1,40 @@
+"""
+Boolean region rendering: cost of each simplify policy over N-way XOR/AND/OR chains of circles.
+
+    python benchmarks/booleans.py [budget_seconds]
+"""
+import sys
+import time
+
+from desmospy import Calculator
+
+def chain(calc, op, n):
+    x,y = calc.x,calc.y
+    val = None
+    for i in range(n):
+        circle = (x-i)**2 + (y-i)**2 < 4
+        val = op(val, circle)
+    return val
+
+def xor(a, b): return a ^ b
+def and_(a, b): return a & b
+def or_(a, b): return a | b
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    print(f'budget for full: {budget}s')
+    print(f'{"op":>4} {"N":>3} {"none (s)":>9} {"fast (s)":>9} {"full (s)":>9} {"none len":>9} {"full len":>9}')
+    for name,op in (('xor', xor), ('and', and_), ('or', or_)):
+        for n in (2, 4, 6, 8, 12, 16):
+            row = {}
+            for policy in ('none', 'fast', 'full'):
+                calc = Calculator(simplify=policy, simplify_budget=budget)
+                expr = calc.set(chain(calc, op, n))
+                start = time.perf_counter()
+                latex = str(expr)
+                row[policy] = (time.perf_counter() - start, len(latex))
+            print(f'{name:>4} {n:>3} {row["none"][0]:>9.4f} {row["fast"][0]:>9.4f} {row["full"][0]:>9.4f}'
+                  f' {row["none"][1]:>9} {row["full"][1]:>9}')
+
+if __name__ == '__main__':
+    main()
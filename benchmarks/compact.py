@@ -0,0 +1,46 @@
+"""
+Page size of each output mode, on the suite cases.
+
+Every case is rebuilt per mode (compact mode quantizes lists and points to 6
+significant digits while they are built). Reports the size of the page and of
+the page gzipped (as served over http), and the reduction against the default
+'expressions' mode.
+
+    python benchmarks/compact.py              # the examples and a few scaling cases
+    python benchmarks/compact.py list ohio    # cases whose name contains any of the arguments
+"""
+import functools
+import gzip
+import sys
+
+import suite
+from desmospy import Calculator
+
+MODES = {
+    'expressions': {},
+    'state': {'mode': 'state'},
+    'compact': {'mode': 'compact'},
+    'compact+deflate': {'mode': 'compact', 'deflate': True},
+}
+DEFAULT_CASES = ('readme', 'function-loop-xor', 'fourier-script-ohio', 'expressions-100', 'list-10000')
+
+def build(name, kwargs):
+    suite.Calculator = functools.partial(Calculator, **kwargs)
+    try:
+        return suite.CASES[name]()
+    finally:
+        suite.Calculator = Calculator
+
+def main(argv):
+    names = [ name for name in suite.CASES if any(arg in name for arg in argv) ] if argv else DEFAULT_CASES
+    print(f'{"case":<22} {"mode":<16} {"bytes":>9} {"gzipped":>9} {"reduction":>10}')
+    for name in names:
+        base = None
+        for mode,kwargs in MODES.items():
+            html = build(name, kwargs).html.encode('utf-8')
+            if base is None:
+                base = len(html)
+            print(f'{name:<22} {mode:<16} {len(html):>9} {len(gzip.compress(html)):>9} {1 - len(html)/base:>9.1%}')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,84 @@
+"""
+Curve decimation: points kept and page size at several pixel tolerances.
+
+Decimates the fourier-script-ohio outline (as a table, at its graph's bounds)
+and the 10,000-point fourier sweep of the same example (precomputed), and times
+decimate() against a recursive Ramer-Douglas-Peucker on a smooth and a noisy
+100,000-point curve (checking that both keep the same points).
+
+    python benchmarks/decimate.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+from desmospy import Calculator, decimate
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+def outline(tolerance):
+    calc = Calculator(size=(1200,600), decimate=tolerance)
+    calc.bounds(left=-50, right=350, bottom=-25, top=275)
+    calc.table(os.path.join(EXAMPLES, 'fourier-script-ohio', 'fourier-script-ohio.csv'))
+    return calc
+
+def sweep(tolerance):
+    calc = Calculator(size=(1200,600), precompute=True, decimate=tolerance)
+    calc.bounds(left=-50, right=350, bottom=-25, top=275)
+    ohio = np.loadtxt(os.path.join(EXAMPLES, 'fourier-script-ohio', 'fourier-script-ohio.csv'),
+                      skiprows=1, delimiter=",", dtype=float)
+    fft = np.fft.fftshift(np.fft.fft(ohio[:,0] + 1j*ohio[:,1]))
+    n = fft.shape[0]
+    fmax = (n-1)//2
+    components = [ (f,round(m,2),round(p,2)) for f,m,p in zip(range(-fmax,fmax+1), np.abs(fft/n), np.angle(fft)) if m > 0.01 ]
+    calc.f,calc.m,calc.p = zip(*components)
+
+    @calc.function
+    def ohio(t):
+        return calc.sum(lambda i: calc.m[i-1] * calc.point(calc.cos(2*calc.pi*t*calc.f[i-1] + calc.p[i-1]),
+                                                              calc.sin(2*calc.pi*t*calc.f[i-1] + calc.p[i-1])),
+                        i=[1, len(components)], broadcast=False)
+    calc.f_scarlet = ohio(calc.range(1,10001)/10000)
+    return calc
+
+def recursive(x, y, tolerance, i, j, kept):
+    if j <= i+1:
+        return
+    dx,dy = x[j] - x[i],y[j] - y[i]
+    distance = np.abs(dx*(y[i+1:j] - y[i]) - dy*(x[i+1:j] - x[i])) / np.hypot(dx, dy)
+    k = i + 1 + np.argmax(distance)
+    if distance[k-i-1] > tolerance:
+        recursive(x, y, tolerance, i, k, kept)
+        kept.append(k)
+        recursive(x, y, tolerance, k, j, kept)
+
+def main():
+    print(f'{"case":<10} {"tolerance":>9} {"points":>7} {"kept":>6} {"bytes":>8} {"render (s)":>11}')
+    for name,build in (('outline', outline), ('sweep', sweep)):
+        for tolerance in (None, 0.25, 0.5, 1, 2):
+            calc = build(tolerance)
+            start = time.perf_counter()
+            html = calc.html
+            elapsed = time.perf_counter() - start
+            points,kept = (sum(curve[i] for curve in calc.decimated()) for i in (1, 2))
+            print(f'{name:<10} {str(tolerance):>9} {points or "-":>7} {kept or "-":>6} {len(html):>8} {elapsed:>11.3f}')
+
+    print(f'\n{"curve":<10} {"points":>7} {"kept":>6} {"decimate (s)":>13} {"recursive (s)":>14}')
+    sys.setrecursionlimit(100000)
+    t = np.linspace(0, 2*np.pi, 100000)
+    walk = np.random.default_rng(0).normal(size=(2, 100000)).cumsum(axis=1)
+    for name,(x,y) in (('smooth', (100*np.cos(t), 100*np.sin(5*t))), ('walk', walk)):
+        start = time.perf_counter()
+        kept = decimate(x, y, 0.5)
+        vectorized = time.perf_counter() - start
+        start = time.perf_counter()
+        reference = [0]
+        recursive(x, y, 0.5, 0, len(x)-1, reference)
+        reference.append(len(x)-1)
+        assert kept.tolist() == reference
+        print(f'{name:<10} {len(x):>7} {len(kept):>6} {vectorized:>13.3f} {time.perf_counter()-start:>14.3f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Frame time of sum() in the browser: the sum form versus list broadcasting with total().
+
+Writes two pages drawing the fourier-script-ohio outline, traced by a dot
+whose sum() is forced to each form. The outline itself keeps the sum form:
+its parameter is bound to a list of t values, which total() would pair with
+the component lists instead of summing for each. The dot's is only bound to
+the t_c slider, a number, and the sums run over the whole lists, so both
+pages compute the same points. Each page animates t_c and, after a warm-up,
+records requestAnimationFrame intervals for a few seconds, then shows the
+mean and 95th percentile frame time (and logs them to the console).
+
+    python benchmarks/frame_time.py [out_dir]   # then open the pages in a browser
+"""
+import os
+import sys
+
+import numpy as np
+
+from desmospy import Calculator
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+MEASURE = """<div id="frame-time" style="position:fixed;top:4px;right:8px;font:14px monospace;color:#eee;z-index:9"></div>
+<script>
+(function() {
+  var out = document.getElementById('frame-time'), times = [], last = null, start = null;
+  function frame(now) {
+    if (start === null) start = now;
+    if (now - start > %(warmup)d) {
+      if (last !== null) times.push(now - last);
+      last = now;
+    }
+    if (now - start < %(warmup)d + %(duration)d) {
+      out.textContent = 'measuring...';
+      return requestAnimationFrame(frame);
+    }
+    times.sort(function(a, b) { return a - b; });
+    var mean = times.reduce(function(a, b) { return a + b; }, 0) / times.length;
+    var p95 = times[Math.floor(times.length * 0.95)];
+    out.textContent = '%(form)s: ' + times.length + ' frames, mean ' + mean.toFixed(1) + ' ms, p95 ' + p95.toFixed(1) + ' ms';
+    console.log(out.textContent);
+  }
+  requestAnimationFrame(frame);
+})();
+</script>
+"""
+
+def build(broadcast):
+    calc = Calculator(size=(1200,600), showGrid=False, showXAxis=False, showYAxis=False)
+    ohio = np.loadtxt(os.path.join(EXAMPLES, 'fourier-script-ohio', 'fourier-script-ohio.csv'), skiprows=1, delimiter=",", dtype=float)
+
+    fft = np.fft.fftshift(np.fft.fft(ohio[:,0] + 1j*ohio[:,1]))
+    n = fft.shape[0]
+    mag = np.abs(fft/n)
+    phase = np.angle(fft)
+    fmax = (n-1)//2
+    components = [ (f,round(m,2),round(p,2)) for f,m,p in zip(range(-fmax,fmax+1),mag,phase) if m>0.01 ]
+    calc.f,calc.m,calc.p = zip(*components)
+
+    def fourier(t, broadcast):
+        def component(i):
+            theta = 2*calc.pi * t*calc.f[i-1] + calc.p[i-1]
+            return calc.m[i-1] * calc.point(calc.cos(theta), calc.sin(theta))
+        return calc.sum(component, i=[1, calc.m.length], broadcast=broadcast)
+    outline = calc.function(lambda t: fourier(t, False), name='outline')
+    tracer = calc.function(lambda t: fourier(t, broadcast), name='tracer')
+
+    calc.t_c = 0
+    calc.f_scarlet = outline(calc.range(1,2001)/2000)
+    calc.f_dot = tracer(calc.t_c)
+    calc.t_c.config(sliderBounds={'min': 0, 'max': 1}, playing=True)
+    calc.f_scarlet.config(points=False, lines=True, lineWidth=5, color="#BE0119")
+    calc.f_dot.config(pointSize=20, pointStyle="OPEN", color="black")
+    calc.bounds(left=-50, right=350, bottom=-25, top=275)
+    return calc
+
+def main():
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else '.'
+    for form,broadcast in (('sum', False), ('total', True)):
+        path = os.path.join(out_dir, f'frame-time-{form}.htm')
+        calc = build(broadcast)
+        with open(path, 'w', encoding='utf-8') as f:
+            calc.save(f)
+            f.write(MEASURE%{'form':form, 'warmup':2000, 'duration':5000})
+        print(f'{form:<6} {path}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Import-time budget for short-lived render processes.
+
+`import desmospy` must stay under BUDGET_MS (cumulative, as reported by
+`python -X importtime`, with bytecode already cached) and must not load IPython
+or sympy: IPython is only imported by Calculator.show(), and sympy is loaded on
+first use by the lazy module proxy.
+
+For reference, eagerly importing sympy and IPython.display costs roughly
+0.5s each.
+
+    python benchmarks/import_time.py
+"""
+import subprocess
+import sys
+
+BUDGET_MS = 50
+RUNS = 5
+
+def import_time_ms():
+    probe = 'import sys, desmospy; print(*(m for m in ("IPython", "sympy.core") if m in sys.modules))'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', probe],
+                            capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == 'desmospy':
+            return int(fields[1]) / 1000, result.stdout.split()
+    raise RuntimeError('desmospy not found in -X importtime output')
+
+def main():
+    import_time_ms() # warm the bytecode cache
+    times = []
+    for _ in range(RUNS):
+        ms, loaded = import_time_ms()
+        times.append(ms)
+    best = min(times)
+    print(f'import desmospy: best {best:.1f} ms of {RUNS} (budget {BUDGET_MS} ms)')
+    if loaded:
+        print(f'eagerly loaded: {", ".join(loaded)}')
+    if best > BUDGET_MS or loaded:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Numeric list formatting: sympy.latex per element versus the direct fast path.
+
+    python benchmarks/lists.py
+"""
+import time
+
+import numpy as np
+import sympy
+
+from desmospy import Calculator, Statement
+
+def sympy_path(values):
+    values = [ sympy.latex(Statement.ref(expr)).replace('\\',r'\\') for expr in values ]
+    return f'[{", ".join(values)}]'
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f'{"N":>8} {"sympy (s)":>10} {"ndarray (s)":>12} {"floats (s)":>11} {"repr (s)":>9} {"speedup":>8}')
+    for n in (1000, 10000, 100000):
+        array = rng.normal(scale=100, size=n).round(2)
+        floats = array.tolist()
+        calc = Calculator()
+        t_sympy = timed(sympy_path, floats)
+        t_array = timed(calc.list, array)
+        t_floats = timed(calc.list, floats)
+        t_repr = timed(calc.list, floats, precision='repr')
+        print(f'{n:>8} {t_sympy:>10.3f} {t_array:>12.4f} {t_floats:>11.4f} {t_repr:>9.4f} {t_sympy/t_floats:>7.0f}x')
+
+if __name__ == '__main__':
+    main()
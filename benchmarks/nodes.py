@@ -0,0 +1,53 @@
+"""
+Expression node construction: throughput and memory per node.
+
+Builds N wrapper nodes through arithmetic operators, N inequalities and N
+`.length` attribute accesses, keeping all of them alive, and reports the time
+and the traced memory per node for each.
+
+    python benchmarks/nodes.py [N]
+"""
+import sys
+import time
+import tracemalloc
+
+from desmospy import Calculator
+
+def operators(calc, n):
+    x,y = calc.x,calc.y
+    return [ (x*i + y) / 2 for i in range(n) ]
+
+def inequalities(calc, n):
+    x,y = calc.x,calc.y
+    return [ x*i < y for i in range(n) ]
+
+def attributes(calc, n):
+    calc.l = [1, 2, 3]
+    l = calc.l
+    return [ l.length for i in range(n) ]
+
+def measure(case, n):
+    calc = Calculator()
+    case(calc, 10) # warm sympy's caches for the symbols involved
+    start = time.perf_counter()
+    case(calc, n)
+    elapsed = time.perf_counter() - start
+
+    calc = Calculator()
+    case(calc, 10)
+    tracemalloc.start()
+    nodes = case(calc, n)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del nodes
+    return elapsed, size
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f'{"case":<14} {"nodes/s":>10} {"bytes/node":>11}')
+    for case in (operators, inequalities, attributes):
+        elapsed,size = measure(case, n)
+        print(f'{case.__name__:<14} {n/elapsed:>10.0f} {size/n:>11.0f}')
+
+if __name__ == '__main__':
+    main()
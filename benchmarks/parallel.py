@@ -0,0 +1,43 @@
+"""
+Parallel rendering: serial Calculator.html versus prerender() in a process pool.
+
+Builds N independent regions (each a fully simplified 3-way xor of circles),
+then renders the page with increasing worker counts. The output is checked to
+be identical to the serial render.
+
+    python benchmarks/parallel.py [N]
+"""
+import os
+import sys
+import time
+
+from desmospy import Calculator
+
+def build(n, workers=None):
+    calc = Calculator(workers=workers)
+    x,y = calc.x,calc.y
+    for i in range(n):
+        val = None
+        for j in range(3):
+            val = val ^ ((x-i-j)**2 + (y+j)**2 < (j+1)**2)
+        calc.set(val)
+    return calc
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    cpus = os.cpu_count() or 1
+    print(f'{n} regions, {cpus} cpus')
+    print(f'{"workers":>8} {"render (s)":>11} {"speedup":>8}')
+    serial = None
+    for workers in sorted({None, 2, 4, cpus}, key=lambda w: w or 0):
+        calc = build(n, workers)
+        start = time.perf_counter()
+        html = calc.html
+        elapsed = time.perf_counter() - start
+        if serial is None:
+            serial = (elapsed, html)
+        assert html == serial[1]
+        print(f'{workers or "serial":>8} {elapsed:>11.3f} {serial[0]/elapsed:>7.2f}x')
+
+if __name__ == '__main__':
+    main()
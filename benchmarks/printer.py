@@ -0,0 +1,53 @@
+"""
+Latex printing: the desmos printer (desmos_latex) versus sympy.latex.
+
+Collects the sympy form of every expression of the benchmark suite's example
+graphs, simplified as they would be rendered, then prints each of them
+repeatedly with both printers. Also counts the expressions printed identically;
+the others use desmos constructs (list elements, inverse trigonometry, ...)
+that sympy.latex prints for LaTeX rather than for desmos.
+
+    python benchmarks/printer.py [REPEAT]
+"""
+import sys
+import time
+
+import sympy
+
+import desmospy
+from desmospy import Boolean
+
+import suite
+
+CASES = ('readme', 'function-loop-xor', 'fourier-script-ohio', 'expressions-100', 'boolean-xor-16', 'sum-nesting-4')
+
+def forms(name):
+    calc = suite.CASES[name]()
+    for expr in calc._rendered_children():
+        form = expr.form
+        if isinstance(expr, Boolean):
+            form = desmospy._simplify(form, expr.simplify, expr.budget)
+        yield form
+
+def timed(printer, exprs, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        for expr in exprs:
+            printer(expr)
+    return time.perf_counter() - start
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f'{"case":<22} {"exprs":>6} {"same":>5} {"sympy (ms)":>11} {"desmos (ms)":>12} {"speedup":>8}')
+    totals = [0.0, 0.0]
+    for name in CASES:
+        exprs = list(forms(name))
+        same = sum(sympy.latex(expr) == desmospy.desmos_latex(expr) for expr in exprs)
+        generic,desmos = timed(sympy.latex, exprs, repeat),timed(desmospy.desmos_latex, exprs, repeat)
+        totals[0] += generic
+        totals[1] += desmos
+        print(f'{name:<22} {len(exprs):>6} {same:>5} {generic/repeat*1000:>11.2f} {desmos/repeat*1000:>12.2f} {generic/desmos:>7.2f}x')
+    print(f'{"total":<22} {"":>6} {"":>5} {totals[0]/repeat*1000:>11.2f} {totals[1]/repeat*1000:>12.2f} {totals[0]/totals[1]:>7.2f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Render service throughput: a python process per request versus the warm `desmospy serve` worker pool.
+
+Renders the README graph as a JSON spec N times: first spawning one process per
+spec, as a backend shelling out would, then posting to a local server from a
+few concurrent clients. Reports requests per second and the server's metrics.
+
+    python benchmarks/serve.py [N]
+"""
+import json
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from desmospy import serve
+
+SPEC = {'expressions': [
+    'y = 1/2*x + 3',
+    'a = 0.3',
+    'y < a*x',
+    'y >= a*x**2',
+    'a*x*y == 1',
+    {'expr': '(x**2/49 + y**2/16 <= 1) | (x**2/16 + y**2/49 <= 1)', 'simplify': 'fast'},
+    {'expr': '(x**2/49 + y**2/16 <= 1) & (x**2/16 + y**2/49 <= 1)', 'simplify': 'fast'},
+    {'expr': '(x**2/49 + y**2/16 <= 1) ^ (x**2/16 + y**2/49 <= 1)', 'simplify': 'fast'},
+]}
+
+def per_process(n):
+    body = json.dumps(SPEC)
+    code = 'import json,sys; from desmospy import serve; sys.stdout.write(serve.render(json.loads(sys.argv[1]))[0])'
+    for i in range(n):
+        subprocess.run([sys.executable, '-c', code, body], check=True, stdout=subprocess.DEVNULL)
+
+def served(n, url, clients):
+    body = json.dumps(SPEC).encode('utf-8')
+    def post(i):
+        with urllib.request.urlopen(urllib.request.Request(url + '/render', data=body, method='POST')) as response:
+            return len(response.read())
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(post, range(n)))
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    print(f'{"mode":<22} {"seconds":>8} {"req/s":>8}')
+    start = time.perf_counter()
+    per_process(n)
+    elapsed = time.perf_counter() - start
+    print(f'{"process per request":<22} {elapsed:>8.2f} {n/elapsed:>8.1f}')
+
+    server = serve.Server(('127.0.0.1', 0))
+    server.quiet = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    served(server.workers, url, server.workers) # wait for the workers to warm up
+    try:
+        for clients in sorted({1, 4, server.workers}):
+            start = time.perf_counter()
+            served(n, url, clients)
+            elapsed = time.perf_counter() - start
+            print(f'{f"serve, {clients} clients":<22} {elapsed:>8.2f} {n/elapsed:>8.1f}')
+        metrics = json.loads(urllib.request.urlopen(url + '/metrics').read())
+        print(f'server: {metrics["requests"]} requests, {metrics["errors"]} errors, '
+              f'latency p50 {metrics["latency_s"]["p50"]*1000:.1f} ms, p95 {metrics["latency_s"]["p95"]*1000:.1f} ms')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Substitution engine scaling: resolve N placeholders in a rendered page.
+
+Compares the single-pass Calculator.resolve() against the previous
+per-key str.replace loop (skipped above 10k, where it becomes quadratic).
+
+    python benchmarks/substitutions.py
+"""
+import time
+
+from desmospy import Calculator
+
+def replace_loop(text, substitutions):
+    for key,sub in substitutions.items():
+        text = text.replace(key, sub)
+    return text
+
+def build(n):
+    calc = Calculator()
+    names = [ str(calc.substitute('(%d, %d)'%(i, -i))) for i in range(n) ]
+    text = '\n  '.join('calculator.setExpression({"latex": "P = %s"});'%name for name in names)
+    return calc, text
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+def main():
+    print(f'{"N":>8} {"resolve (s)":>12} {"us/sub":>8} {"replace (s)":>12}')
+    for n in (100, 1000, 10000, 100000):
+        calc, text = build(n)
+        t_new, new = timed(calc.resolve, text)
+        t_old = '-'
+        if n <= 10000:
+            t_old, old = timed(replace_loop, text, calc._substitutions)
+            assert old == new
+            t_old = f'{t_old:.4f}'
+        print(f'{n:>8} {t_new:>12.4f} {1e6*t_new/n:>8.2f} {t_old:>12}')
+
+if __name__ == '__main__':
+    main()
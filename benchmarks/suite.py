@@ -0,0 +1,181 @@
+"""
+Benchmark suite: rebuild the shipped examples and synthetic scaling cases headlessly.
+
+For each case, records the build time (python expressions), the render time
+(Calculator.html), the peak traced memory of both (tracemalloc, on a second
+untimed run) and the size of the generated page.
+
+    python benchmarks/suite.py                 # all cases
+    python benchmarks/suite.py xor ohio        # cases whose name contains any of the arguments
+    python benchmarks/suite.py --json out.json # also save the results, to compare between revisions
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from desmospy import Calculator
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+def readme():
+    c = Calculator()
+    c.y = 1/2 * c.x + 3
+    c.a = 0.3
+    a,x,y = c.a,c.x,c.y
+    c.set(y < a*x)
+    c.set(y >= a*x**2)
+    c.set(a*x*y == 1)
+    A = (x**2 / 49 + y**2 / 16 <= 1)
+    B = (x**2 / 16 + y**2 / 49 <= 1)
+    c.set(A | B)
+    c.set(A & B)
+    c.set(A ^ B)
+    return c
+
+def function_loop_xor():
+    calc = Calculator(size=(800,600), showGrid=False, showXAxis=False, showYAxis=False)
+    calc.function(lambda x,y,r: (y)**2 + (x)**2 < r**2, name="circle")
+
+    @calc.function
+    def combo(x, y, a=6.1, r0=5.6):
+        val = None
+        step = 2*calc.pi/16
+        for i in range(16):
+            x0 = a * calc.cos(step*i)
+            y0 = a * calc.sin(step*i)
+            val = val ^ calc.circle(x-x0, y-y0, r0)
+        return val
+
+    x,y = calc.x,calc.y
+    calc.set(combo(x,y))
+    calc.set(combo(x,y) >= (calc.a+calc.r0)**23)
+    return calc
+
+def fourier_script_ohio():
+    calc = Calculator(size=(1200,600), showGrid=False, showXAxis=False, showYAxis=False)
+    path = os.path.join(EXAMPLES, 'fourier-script-ohio', 'fourier-script-ohio.csv')
+    ohio = np.loadtxt(path, skiprows=1, delimiter=",", dtype=float)
+
+    fft = np.fft.fftshift(np.fft.fft(ohio[:,0] + 1j*ohio[:,1]))
+    n = fft.shape[0]
+    mag = np.abs(fft/n)
+    phase = np.angle(fft)
+    fmax = (n-1)//2
+    components = list(zip(range(-fmax,fmax+1),mag,phase))
+    components.sort(key=lambda fmp: abs(fmp[0]))
+
+    f_m_p = [ (f,round(m,2),round(p,2)) for f,m,p in components if m>0.01 ]
+    calc.f,calc.m,calc.p = zip(*f_m_p)
+    calc.n_f = len(f_m_p)
+
+    def unit_vector(theta):
+        return calc.point(calc.cos(theta), calc.sin(theta))
+
+    @calc.function
+    def ohio(t, n):
+        def component(i):
+            return calc.m[i-1] * unit_vector(2*calc.pi * t*calc.f[i-1] + calc.p[i-1])
+        return calc.sum(component, i=[1,n])
+
+    calc.t_c = 0
+    calc.f_scarlet = ohio(2*calc.range(1,10001)/10000, calc.n_f)
+    calc.f_gray = ohio(calc.t_c, calc.range(1,calc.n_f+1))
+    calc.f_dot = ohio(calc.t_c, calc.n_f)
+    calc.t_c.config(sliderBounds={'min': 0, 'max': 1}, playing=True)
+    calc.f_scarlet.config(points=False, lines=True, lineWidth=5, color="#BE0119")
+    calc.f_gray.config(points=True, pointSize=3, lines=True, lineWidth=1, color="#111111")
+    calc.f_dot.config(pointSize=20, pointStyle="OPEN", color="black")
+    calc.bounds(left=-50, right=350, bottom=-25, top=275)
+    return calc
+
+def expressions(n):
+    calc = Calculator()
+    for i in range(n):
+        calc.set(calc.y == calc.sin(calc.x + i) * i)
+    return calc
+
+def numeric_list(n):
+    calc = Calculator()
+    calc.l = np.linspace(0, 1, n)
+    return calc
+
+def boolean(n, op='xor'):
+    calc = Calculator()
+    x,y = calc.x,calc.y
+    val = None
+    for i in range(n):
+        circle = (x-i)**2 + (y-i)**2 < 4
+        val = {'xor': lambda a,b: a ^ b, 'and': lambda a,b: a & b, 'or': lambda a,b: a | b}[op](val, circle)
+    calc.set(val, simplify='fast') # see booleans.py for the cost of each policy
+    return calc
+
+def sum_nesting(depth):
+    calc = Calculator()
+    indices = 'ijklmnopq'[:depth]
+    def nest(level, outer):
+        if level == depth:
+            return outer
+        index = indices[level]
+        return calc.sum(lambda i: nest(level+1, outer * i + calc.x), **{index: [1, 10]})
+    calc.y = nest(0, 1)
+    return calc
+
+CASES = {
+    'readme': readme,
+    'function-loop-xor': function_loop_xor,
+    'fourier-script-ohio': fourier_script_ohio,
+}
+for n in (10, 100, 1000):
+    CASES[f'expressions-{n}'] = lambda n=n: expressions(n)
+for n in (1000, 10000, 100000):
+    CASES[f'list-{n}'] = lambda n=n: numeric_list(n)
+for op in ('xor', 'and', 'or'):
+    for n in (4, 8, 16):
+        CASES[f'boolean-{op}-{n}'] = lambda n=n, op=op: boolean(n, op)
+for depth in (1, 2, 4, 8):
+    CASES[f'sum-nesting-{depth}'] = lambda depth=depth: sum_nesting(depth)
+
+def measure(build):
+    # time without tracing, then rebuild under tracemalloc for the peak (tracing slows sympy down several times)
+    start = time.perf_counter()
+    calc = build()
+    built = time.perf_counter()
+    html = calc.html
+    rendered = time.perf_counter()
+
+    tracemalloc.start()
+    build().html
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'build_s': built - start,
+        'render_s': rendered - built,
+        'peak_mb': peak / 2**20,
+        'bytes': len(html.encode('utf-8')),
+    }
+
+def main(argv):
+    output = None
+    if '--json' in argv:
+        i = argv.index('--json')
+        output = argv[i+1]
+        argv = argv[:i] + argv[i+2:]
+    names = [ name for name in CASES if not argv or any(arg in name for arg in argv) ]
+
+    Calculator().html # load sympy before timing anything
+    results = {}
+    print(f'{"case":<22} {"build (s)":>10} {"render (s)":>11} {"peak (MB)":>10} {"bytes":>10}')
+    for name in names:
+        result = results[name] = measure(CASES[name])
+        print(f'{name:<22} {result["build_s"]:>10.4f} {result["render_s"]:>11.4f}'
+              f' {result["peak_mb"]:>10.2f} {result["bytes"]:>10}')
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
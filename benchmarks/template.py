@@ -0,0 +1,55 @@
+"""
+Parameter sweeps: rebuilding and rendering each variant versus filling a template.
+
+Writes N variants of the function-loop-xor example, differing in the distance
+a and radius r0 of the circles, both ways; the pages are checked to be
+identical.
+
+    python benchmarks/template.py [N]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from desmospy import Calculator
+
+def build(a=6.1, r0=5.6):
+    calc = Calculator(size=(800,600), showGrid=False, showXAxis=False, showYAxis=False)
+    calc.function(lambda x,y,r: (y)**2 + (x)**2 < r**2, name="circle")
+
+    def combo(x, y, a=a, r0=r0):
+        val = None
+        step = 2*calc.pi/16
+        for i in range(16):
+            val = val ^ calc.circle(x - a*calc.cos(step*i), y - a*calc.sin(step*i), r0)
+        return val
+    combo = calc.function(combo)
+    calc.set(combo(calc.x,calc.y))
+    return calc
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    params = [ {'a': 6 + i/n, 'r0': 5 + i/n} for i in range(n) ]
+    build().html # load sympy before timing anything
+    print(f'{n} variants')
+    print(f'{"method":<20} {"total (s)":>10} {"per page (ms)":>14}')
+    with tempfile.TemporaryDirectory() as rebuilt, tempfile.TemporaryDirectory() as filled:
+        start = time.perf_counter()
+        for index,values in enumerate(params):
+            build(**values).save(os.path.join(rebuilt, f'page-{index:04d}.htm'))
+        elapsed = time.perf_counter() - start
+        print(f'{"rebuild + render":<20} {elapsed:>10.3f} {1000*elapsed/n:>14.2f}')
+
+        for workers in (None, 4):
+            start = time.perf_counter()
+            paths = build().template('a', 'r0').render_many(params, filled, workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f'{"template, " + str(workers or "serial"):<20} {elapsed:>10.3f} {1000*elapsed/n:>14.2f}')
+
+        for path in paths:
+            with open(path) as f, open(os.path.join(rebuilt, os.path.basename(path))) as g:
+                assert f.read() == g.read(), path
+
+if __name__ == '__main__':
+    main()
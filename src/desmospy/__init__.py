@@ -1,21 +1,540 @@
+import json
+import atexit
+import base64
+import bisect
+import gzip
+import hashlib
+import re
+import secrets
+import math
+import os
+import pickle
+import functools
+import itertools
+import signal
+import threading
+import time
+import warnings
+import contextlib
+import importlib
+
+class _lazy_import(object):
+    """
+    Stand-in for a module, imported on first attribute access
+        - keeps `import desmospy` cheap; sympy is only loaded once an expression is built
+        - the import runs once, under a lock, so threads building their first expressions together all see the whole module
+        - once imported, the module replaces this stand-in as the global of the same name
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
 
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self._name)
+                if globals().get(self._name) is self:
+                    globals()[self._name] = self._module
+        return self._module
 
-from IPython.display import IFrame
+    def __getattr__(self, attr):
+        return getattr(self._module or self._load(), attr)
 
-import json
-import sympy
-import base64
+sympy = _lazy_import('sympy')
+
+class _lazy_class(object):
+    """
+    Class attribute holding a class built on first access
+        - lets sympy subclasses be defined without importing sympy; set __qualname__ to keep them picklable
+    """
+    def __init__(self, factory):
+        self._factory = functools.lru_cache(None)(factory)
+
+    def __get__(self, obj, owner):
+        return self._factory()
+
+def _number_strings(values, precision=15):
+    """
+    Format a flat sequence of real numbers as desmos latex strings, without going through sympy.
+        - precision is the number of significant digits, or 'repr' for the shortest exact form
+        - returns None if values is not a 1-D sequence of finite numbers, so the caller can fall back to sympy
+    """
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is not None:
+        try:
+            array = numpy.asarray(values)
+        except (TypeError, ValueError):
+            return None
+        if array.ndim != 1 or array.dtype.kind not in 'iuf':
+            return None
+        if array.dtype.kind == 'f' and not numpy.isfinite(array).all():
+            return None
+        integral = array.dtype.kind != 'f'
+        values = array.tolist()
+    else:
+        if any(type(v) not in (int, float) for v in values):
+            return None
+        if not all(map(math.isfinite, values)):
+            return None
+        integral = all(type(v) is int for v in values)
+
+    if integral:
+        fmt = '%d'
+    elif precision == 'repr':
+        fmt = '%r'
+    else:
+        fmt = '%%.%dg'%precision
+    strings = list(map(fmt.__mod__, values))
+    if not integral:
+        # desmos doesn't read exponent notation
+        strings = [ _exponent.sub(r'\\cdot10^{\1\2}', s) if 'e' in s else s for s in strings ]
+    return strings
+
+_exponent = re.compile(r'e\+?(-?)0*(\d+)')
+
+def _format_numbers(values, precision=15):
+    """
+    Format a flat sequence of real numbers as an escaped, comma separated latex string, or return None.
+    """
+    strings = _number_strings(values, precision)
+    if strings is None:
+        return None
+    return ', '.join(strings).replace('\\',r'\\')
+
+def _script_safe(text):
+    """ Escape JSON (or JS literals) to embed in a <script>, so no string in it can close the script or open a comment. """
+    return text.replace('</', '<\\/').replace('<!--', '<\\u0021--')
+
+def decimate(x, y, tolerance):
+    """
+    Simplify the curve through points (x, y) with Ramer-Douglas-Peucker, within tolerance (in the units of x and y)
+        - returns the sorted indices of the points to keep, always including the first and last
+        - vectorized with numpy: each pass splits every open segment at its farthest point, if beyond tolerance,
+          and drops the points of the segments that are within it
+    """
+    import numpy
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    n = len(x)
+    if n < 3 or not (numpy.isfinite(x).all() and numpy.isfinite(y).all()):
+        return numpy.arange(n)
+    keep = numpy.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    active = numpy.arange(1, n-1) # the points of open segments
+    while len(active):
+        kept = numpy.flatnonzero(keep)
+        segment = numpy.searchsorted(kept, active) - 1
+        # group the active points by segment, to find the (first) farthest point of each
+        firsts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(segment)) + 1))
+        counts = numpy.diff(numpy.append(firsts, len(active)))
+        start,end = kept[segment[firsts]],kept[segment[firsts]+1]
+        x0,y0 = x[start],y[start]
+        dx,dy = x[end] - x0,y[end] - y0
+        length = numpy.hypot(dx, dy)
+        closed = length == 0
+        length[closed] = 1
+        # distance to the line of each segment, as |a*x + b*y + c|
+        a,b,c = ( numpy.repeat(k, counts) for k in (-dy/length, dx/length, (dy*x0 - dx*y0)/length) )
+        px,py = x[active],y[active]
+        distance = numpy.abs(a*px + b*py + c)
+        if closed.any(): # the start of a closed segment
+            near = numpy.repeat(closed, counts)
+            distance[near] = numpy.hypot(px[near] - numpy.repeat(x0, counts)[near], py[near] - numpy.repeat(y0, counts)[near])
+        group = numpy.repeat(numpy.arange(len(firsts)), counts)
+        farthest = numpy.maximum.reduceat(distance, firsts)
+        split = farthest > tolerance
+        hits = numpy.flatnonzero((distance == farthest[group]) & split[group])
+        hits = hits[numpy.unique(group[hits], return_index=True)[1]]
+        keep[active[hits]] = True
+        remaining = split[group]
+        remaining[hits] = False
+        active = active[remaining]
+    return numpy.flatnonzero(keep)
+
+class RenderStats(object):
+    """
+    Render statistics, collected inside Calculator.profile()
+        - phases: seconds spent in 'latex', 'simplify', 'json' and 'resolve', and the 'total' of the block
+        - children: one (id, name, seconds, bytes) tuple per top-level child and render; folders include their members
+        - resolved: number of placeholders replaced; substitutions: size of the substitution table
+        - bytes: size of all rendered expressions (excluding the page template)
+        - decimated: one (source, points, kept) tuple per curve decimated while rendering (see Calculator.decimated())
+    """
+    def __init__(self):
+        self.phases = dict.fromkeys(('latex', 'simplify', 'json', 'resolve', 'total'), 0.0)
+        self.children = []
+        self.resolved = 0
+        self.substitutions = 0
+        self.bytes = 0
+        self.decimated = []
+
+    def as_dict(self):
+        return {
+            'phases': dict(self.phases),
+            'children': [ dict(zip(('id', 'name', 'seconds', 'bytes'), child)) for child in self.children ],
+            'resolved': self.resolved,
+            'substitutions': self.substitutions,
+            'bytes': self.bytes,
+            'decimated': [ dict(zip(('source', 'points', 'kept'), curve)) for curve in self.decimated ],
+        }
+
+    def report(self, top=10):
+        """ Summarize the phases and the most expensive children as text. """
+        lines = ['phase        seconds']
+        lines += [ f'{phase:<10} {seconds:>9.4f}' for phase,seconds in self.phases.items() ]
+        lines += [f'placeholders resolved: {self.resolved} (table of {self.substitutions})',
+                  f'output bytes: {self.bytes}',
+                  'decimated points: %d of %d kept'%(sum(c[2] for c in self.decimated), sum(c[1] for c in self.decimated)),
+                  '',
+                  '   id    seconds      bytes  name']
+        children = sorted(self.children, key=lambda child: -child[2])[:top]
+        lines += [ f'{id:>5} {seconds:>10.4f} {size:>10}  {name}' for id,name,seconds,size in children ]
+        return '\n'.join(lines)
+
+_profile = None
+
+# the most elements desmos accepts in a list
+_LIST_CAP = 10000
+
+# latex that replaces str(expr) in the page being rendered, if any: expressions rewritten
+# by hoisting (see Calculator.hoist()) and the holes of a template (see Calculator.template())
+_overrides = None
+
+def _timed(phase, fn, *args, **kwargs):
+    """ Call fn, adding its duration to the active profile (if any) under phase. """
+    if _profile is None:
+        return fn(*args, **kwargs)
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _profile.phases[phase] += time.perf_counter() - start
+
+class _NotConcrete(Exception):
+    pass
+
+class _Expired(Exception):
+    pass
+
+_policies = ('none', 'fast', 'full')
+
+def _check_policy(policy):
+    if policy not in _policies:
+        raise ValueError(f'unknown simplify policy "{policy}"')
+    return policy
+
+def _simplify(expr, policy='full', budget=None):
+    """
+    Simplify a region before it is printed
+        - 'none' leaves the expression as built
+        - 'fast' only puts a relation in canonical form (sympy already flattens nested Min, Max and Mul)
+        - 'full' runs sympy.simplify; after budget seconds (if given) it gives up and keeps the unsimplified form
+        - the budget relies on SIGALRM, so it is only enforced on the main thread of POSIX systems
+    """
+    if policy == 'none':
+        return expr
+    if policy == 'fast':
+        return expr.canonical if isinstance(expr, sympy.core.relational.Relational) else expr
+    _check_policy(policy)
+    if budget is None or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        return sympy.simplify(expr)
+
+    def expire(signum, frame):
+        raise _Expired()
+    previous = signal.signal(signal.SIGALRM, expire)
+    # a timer the caller armed is suspended meanwhile (cutting the budget short if it is due first),
+    # then re-armed with its remaining time, along with the caller's handler
+    start = time.monotonic()
+    delay,interval = 0, 0
+    try:
+        try:
+            delay,interval = signal.setitimer(signal.ITIMER_REAL, budget)
+            if 0 < delay < budget:
+                signal.setitimer(signal.ITIMER_REAL, delay)
+            expr = sympy.simplify(expr)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    except _Expired:
+        pass
+    finally:
+        signal.signal(signal.SIGALRM, previous)
+        if delay:
+            signal.setitimer(signal.ITIMER_REAL, max(delay - (time.monotonic() - start), 1e-6), interval)
+    return expr
+
+@functools.lru_cache(None)
+def _printer_class():
+    from sympy.printing.latex import LatexPrinter
+    from sympy.core.function import AppliedUndef, UndefinedFunction
+
+    class DesmosPrinter(LatexPrinter):
+        """
+        LatexPrinter for desmos
+            - prints desmos constructs (list elements, attributes, total(), sharded list elements) and inverse trigonometry
+            - dispatches on a table of print methods per type, rather than searching each node's class hierarchy
+            - memoizes the latex of symbol and function names (subscripts, greek letters), and orders terms without evalf
+        """
+        _default_settings = dict(LatexPrinter._default_settings, inv_trig_style='power')
+        _dispatch = {}
+        _symbols = {}
+
+        def _print(self, expr, **kwargs):
+            cls = type(expr)
+            method = self._dispatch.get(cls)
+            if method is None:
+                if isinstance(expr, type): # a class, e.g. sympy.sin
+                    return LatexPrinter._print(self, expr, **kwargs)
+                method = self._dispatch[cls] = self._method(cls)
+            self._print_level += 1
+            try:
+                return method(self, expr, **kwargs)
+            finally:
+                self._print_level -= 1
+
+        @classmethod
+        def _method(cls, expr_cls):
+            """ The print method of expr_cls, as Printer._print() would find it """
+            if hasattr(expr_cls, cls.printmethod):
+                return lambda printer, expr, **kwargs: getattr(expr, cls.printmethod)(printer, **kwargs)
+            classes = expr_cls.__mro__
+            for base in (AppliedUndef, UndefinedFunction):
+                if base in classes:
+                    classes = classes[classes.index(base):]
+            if sympy.Function in classes:
+                i = classes.index(sympy.Function)
+                classes = tuple(c for c in classes[:i] if c.__name__ == classes[0].__name__ or c.__name__.endswith('Base')) + classes[i:]
+            for base in classes:
+                method = getattr(cls, '_print_' + base.__name__, None)
+                if method is not None:
+                    return method
+            return lambda printer, expr, **kwargs: printer.emptyPrinter(expr)
+
+        def _print_Symbol(self, expr, style='plain'):
+            tex = self._settings['symbol_names'].get(expr)
+            if tex is not None:
+                return tex
+            name = expr.name
+            tex = self._symbols.get((name, style))
+            if tex is None:
+                tex = self._symbols[(name, style)] = self._deal_with_super_sub(name, style=style)
+            return tex
+
+        def _as_ordered_terms(self, expr, order=None):
+            """ The terms of an Add in sympy's default order, as Expr.as_ordered_terms(), with numbers converted directly """
+            if (order or self.order) is not None or not expr.is_Add:
+                return LatexPrinter._as_ordered_terms(self, expr, order)
+            terms = expr.args
+            numbers = (sympy.Number, sympy.NumberSymbol)
+            if len(terms) == 2: # sympy's special case of Number + Mul(-Number, expr), e.g. 1 - x
+                add_args = sorted(terms, key=lambda term: not isinstance(term, numbers))
+                if isinstance(add_args[0], numbers) and add_args[1].is_Mul:
+                    mul_args = sorted(add_args[1].args, key=lambda factor: not isinstance(factor, numbers))
+                    if (len(mul_args) == 2 and isinstance(mul_args[0], sympy.Number)
+                            and add_args[0].is_positive and mul_args[0].is_negative):
+                        return add_args
+            if any(term.is_Order for term in terms):
+                return LatexPrinter._as_ordered_terms(self, expr, order)
+
+            from sympy.core.exprtools import decompose_power
+            def number(n):
+                return complex(float(n)) if n.is_Rational or n.is_Float else complex(n)
+            gens,parts = set(),[]
+            for term in terms:
+                coeff,rest = term.as_coeff_Mul()
+                coeff = number(coeff)
+                cpart,ncpart = {},[]
+                if rest is not sympy.S.One:
+                    for factor in sympy.Mul.make_args(rest):
+                        if factor.is_number:
+                            try:
+                                coeff *= number(factor)
+                                continue
+                            except (TypeError, ValueError):
+                                pass
+                        if factor.is_commutative:
+                            base,exp = decompose_power(factor)
+                            cpart[base] = exp
+                            gens.add(base)
+                        else:
+                            ncpart.append(factor)
+                parts.append((term, ((coeff.real, coeff.imag), cpart, tuple(ncpart))))
+            indices = dict((gen, i) for i,gen in enumerate(sorted(gens, key=sympy.default_sort_key)))
+            ordered = []
+            for term,(coeff,cpart,ncpart) in parts:
+                monom = [0]*len(indices)
+                for base,exp in cpart.items():
+                    monom[indices[base]] = exp
+                ordered.append((term, (coeff, tuple(monom), ncpart)))
+            key,reverse = expr._parse_order(None)
+            return [ term for term,_ in sorted(ordered, key=key, reverse=reverse) ]
+
+        def _hprint_Function(self, func):
+            tex = self._symbols.get((func, 'function'))
+            if tex is None:
+                tex = self._symbols[(func, 'function')] = LatexPrinter._hprint_Function(self, func)
+            return tex
+
+        def _print_AttrSymbol(self, expr, **kwargs):
+            return expr.name
+
+        def _print_Indexed(self, expr):
+            return '{%s}[%s]'%(self._print(expr.base), ','.join(self._print(i+1) for i in expr.indices))
+
+        def _power(self, tex, exp):
+            return tex if exp is None else '%s^{%s}'%(tex, exp)
+
+        def _print_Total(self, expr, exp=None):
+            return self._power(r'\operatorname{total}\left(%s\right)'%self._print(expr.args[0]), exp)
+
+        def _print_Element(self, expr, exp=None):
+            index,shards,starts = expr.args[:3]
+            elements = [ '{%s}[%s]'%(self._print(shard), self._print(index - start + 1)) for shard,start in zip(shards, starts) ]
+            conditions = [ '%s < %s: '%(self._print(index), self._print(start)) for start in starts[1:] ] + ['']
+            return self._power(r'\left\{%s\right\}'%', '.join(condition + element for condition,element in zip(conditions, elements)), exp)
+
+        def _print_Function(self, expr, exp=None):
+            if exp is not None and isinstance(expr, (sympy.asin, sympy.acos, sympy.atan)): # not \sin^{-1}{\left(x \right)}^{2}
+                return r'\left(%s\right)^{%s}'%(LatexPrinter._print_Function(self, expr), exp)
+            return LatexPrinter._print_Function(self, expr, exp)
+
+        def _print_atan2(self, expr, exp=None):
+            tex = r'\tan^{-1}{\left(%s \right)}'%','.join(self._print(arg) for arg in expr.args)
+            return tex if exp is None else r'\left(%s\right)^{%s}'%(tex, exp)
+
+    DesmosPrinter.__qualname__ = 'DesmosPrinter'
+    return DesmosPrinter
+
+_printers = threading.local()
+
+def desmos_latex(expr):
+    """ Print a sympy expression as desmos latex, with a printer reused per thread. """
+    printer = getattr(_printers, 'printer', None)
+    if printer is None:
+        printer = _printers.printer = _printer_class()()
+    return printer.doprint(expr)
+
+def _render_latex(expr, simplify=None, budget=None):
+    if simplify:
+        expr = _timed('simplify', _simplify, expr, simplify, budget)
+    return _timed('latex', desmos_latex, expr)
+
+_shared_render = None
+
+def render_cache(maxsize=1024):
+    """
+    Share rendered latex between all expressions and calculators, in a LRU cache of maxsize entries.
+        - keyed on the (immutable) sympy expression, so repeated subexpressions and functions are printed once
+        - maxsize=0 turns the shared cache off again
+    """
+    global _shared_render
+    _shared_render = functools.lru_cache(maxsize)(_render_latex) if maxsize else None
+
+def render_latex(expr, simplify=None, budget=None):
+    """ Render a sympy expression as latex, through the shared cache if it is enabled. """
+    if _shared_render is not None:
+        try:
+            return _shared_render(expr, simplify, budget)
+        except TypeError: # unhashable
+            pass
+    return _render_latex(expr, simplify, budget)
+
+def _render_child(expr):
+    return expr.render()
+
+@functools.lru_cache(None)
+def _snapshot_format():
+    """
+    Tag of the snapshots written by dump(), also part of the cached() keys
+        - snapshots pickle desmospy's own classes, so the tag hashes this module's source
+        - where the source can't be read (zipimport, frozen builds), the package version stands in
+    """
+    try:
+        with open(__file__, 'rb') as f:
+            version = hashlib.sha256(f.read()).hexdigest()[:16]
+    except (NameError, OSError):
+        import importlib.metadata
+        try:
+            version = importlib.metadata.version('desmospy')
+        except importlib.metadata.PackageNotFoundError:
+            version = None
+    return ('desmospy-snapshot', 1, version)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _pool(workers, broken=None):
+    """
+    The pool of this many worker processes rendering for prerender(), started on first use and shut down at exit
+        - broken is a pool found broken, to replace
+    """
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None or pool is broken:
+            from concurrent.futures import ProcessPoolExecutor
+            if pool is not None:
+                pool.shutdown(wait=False)
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+        return pool
+
+@atexit.register
+def _shutdown_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=False)
+        _pools.clear()
+
+@contextlib.contextmanager
+def _writing(filename, compress=False):
+    """ Open filename to write text, aside and renamed into place once complete, so a failure never leaves a truncated page. """
+    partial = f'{filename}.{os.getpid()}.part'
+    opener = gzip.open if compress else open
+    try:
+        with opener(partial, 'wt', encoding='utf-8') as f:
+            yield f
+        os.replace(partial, filename)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(partial)
+        raise
+
+# pages show(tempdir=...) wrote: their IFrames load them after show() returns, so they are removed when python exits
+_temp_pages = []
+
+@atexit.register
+def _remove_temp_pages():
+    while _temp_pages:
+        with contextlib.suppress(OSError):
+            os.remove(_temp_pages.pop())
 
 class ExpressionCollection(object):
     def get_id(self, obj):
         return self._root.get_id(obj)
+
+    # pickle the attributes directly, as __getattr__ would otherwise answer for __setstate__ before they exist
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if '_display' in state:
+            state['_display'] = None # a display belongs to the kernel that showed it
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
     
     def config(self, **kwargs):
         for child in self._children:
             if 'config' in dir(child):
                 child.config(**kwargs)
     
-    def function(self, f, name=None):
+    def function(self, f, name=None, precompute=False):
+        """
+        Define a desmos function from a python function of statements
+            - with precompute, definitions applying it to concrete values are evaluated in python (see Calculator.precompute())
+        """
         import inspect
         argspec = inspect.getfullargspec(f)
         args = argspec.args
@@ -28,7 +547,8 @@ class ExpressionCollection(object):
                 self.__setattr__(arg, val)
             args = args[:split]
 
-        expr = f(*attrs)
+        with self._root._defining(args):
+            expr = f(*attrs)
         if isinstance(expr, Boolean) or isinstance(expr, Inequality):
             expr = expr.lump
 
@@ -40,18 +560,17 @@ class ExpressionCollection(object):
         expr = Equality(fn(*args), expr)
         self.set(expr)
         
-        fn.config = expr.config
+        fn._owner = expr
+        if precompute:
+            self._root._precompute_fns.add(fn._fn)
         return fn
 
-    _desmos_fns = {
-        'asin': '\\\\sin^{-1}',
-        'acos': '\\\\cos^{-1}',
-        'atan': '\\\\tan^{-1}',
-        'atan2': '\\\\tan^{-1}',
-        'arcsin': '\\\\sin^{-1}',
-        'arccos': '\\\\cos^{-1}',
-        'arctan': '\\\\tan^{-1}',
-        'arctan2': '\\\\tan^{-1}',
+    # numpy names of sympy functions (printed as desmos reads them, see DesmosPrinter)
+    _fn_aliases = {
+        'arcsin': 'asin',
+        'arccos': 'acos',
+        'arctan': 'atan',
+        'arctan2': 'atan2',
     }
     
     def __getattr__(self, name):
@@ -59,18 +578,15 @@ class ExpressionCollection(object):
         if statement is not None:
             return statement
 
-        if name in self._desmos_fns:
-            statement = self.substitute(self._desmos_fns[name], cls=Function)
-        else:
-            try:
-                attr = sympy.__getattribute__(name)
-                if not isinstance(attr, sympy.core.function.FunctionClass):
-                    return attr
-                statement = NativeFunction(attr)
-            except AttributeError as e:
-                if "module 'sympy' has no attribute" not in str(e):
-                    raise
-                statement = Statement(name)
+        try:
+            attr = getattr(sympy, self._fn_aliases.get(name, name))
+            if not isinstance(attr, sympy.core.function.FunctionClass):
+                return attr
+            statement = NativeFunction(attr)
+        except AttributeError as e:
+            if "module 'sympy' has no attribute" not in str(e):
+                raise
+            statement = Statement(name)
         self._root._cache[name] = statement
         return statement
 
@@ -80,6 +596,9 @@ class ExpressionCollection(object):
         if isinstance(value, tuple) and len(value) == 2:
             value = self.point(*value)
         elif '__iter__' in dir(value):
+            if '__len__' in dir(value) and len(value) > _LIST_CAP:
+                self.ingest(value, names=[name])
+                return
             value = self.list(value)
 
         if isinstance(value, IndexedBaseValue):
@@ -94,21 +613,40 @@ class ExpressionCollection(object):
         "Make sure this object is active before adding children."
         pass
     
-    def set(self, expr, **kwargs):
+    def set(self, expr, simplify=None, precompute=None, **kwargs):
+        """
+        Add an expression
+            - simplify overrides the calculator's simplification policy ('none', 'fast' or 'full') for a combined region
+            - precompute overrides the calculator's precompute setting for a definition (see Calculator.precompute())
+            - remaining kwargs are forwarded to Desmos as the expression's state
+        """
+        if simplify is not None:
+            _check_policy(simplify)
         self.activate()
         if isinstance(expr, Statement):
             expr = expr >= 0
+        if isinstance(expr, Boolean):
+            expr.simplify = simplify or self._root._simplify
+            expr.budget = self._root._simplify_budget
+        if isinstance(expr, Equality):
+            expr.precompute = precompute
         if kwargs:
             expr.config(**kwargs)
         self._children.append(expr)
         return expr
 
     def abs(self, expr):
-        val = Statement()
-        val.expr = sympy.Abs(Statement.ref(expr))
-        return val
+        return Statement._wrap(sympy.Abs(Statement.ref(expr)))
 
-    def sum(self, function, **kwargs):
+    def sum(self, function, broadcast=None, **kwargs):
+        """
+        Sum function(i) over an index, e.g. calc.sum(lambda i: calc.m[i-1], i=[1, calc.m.length])
+            - when function(i) only uses i to pick the elements of lists, over their whole length, the sum
+              is lowered to desmos list broadcasting, e.g. total(m), which desmos evaluates much faster
+              and the other variables it uses are known to be numbers (not lists, nor parameters of a function being defined,
+              which calls may bind to lists: total() would then pair their elements with the lists' instead of summing for each)
+            - broadcast=True forces the total() form whatever the bounds and variables, broadcast=False keeps the sum form
+        """
         # pop other kwargs, if any
         if len(kwargs) > 1:
             raise ValueError(f'sum() received unknown arguments: {kwargs}')
@@ -120,36 +658,89 @@ class ExpressionCollection(object):
         expr = Statement.ref(function(index))
         lower = Statement.ref(lower)
         upper = Statement.ref(upper)
+        if broadcast is not False:
+            lowered = self._root._broadcast(expr, index, lower, upper, force=broadcast)
+            if lowered is not None:
+                return Statement(lowered)
+            if broadcast:
+                raise ValueError(f'sum() over {index} can\'t be lowered to a total(): {index} is not only used to index lists')
         return Statement(sympy.Sum(expr, (index,lower,upper)))
 
+    @_lazy_class
+    def Total():
+        class Total(sympy.Function):
+            """ desmos total() of a list (see DesmosPrinter) """
+        Total.__qualname__ = 'ExpressionCollection.Total'
+        return Total
+
     def substitute(self, value, cls=None, **kwargs):
+        """
+        Stand a placeholder symbol in for the latex string value, replaced when rendering (see resolve())
+            - values are interned: identical strings (e.g. the same point built in a loop) share one placeholder
+        """
         if cls is None:
             cls = Statement
-        var = 'v_{custom%04d}'%len(self._root._substitutions)
-        self._root._substitutions[var] = value
+        root = self._root
+        # resolve nested placeholders now, so each value is final when stored
+        value = root.resolve(value)
+        var = root._interned.get(value)
+        if var is None:
+            var = root._interned[value] = 'v_{custom%04d}'%len(root._substitutions)
+            root._substitutions[var] = value
         return cls(var, **kwargs)
     
-    def point(self, *args):
+    def point(self, *args, precision=None, decimate=None):
         """
         Capture a point expression
             - sympy doesn't perform algebra (e.g. absolute value) on points -- it completely crashes
+            - plain number coordinates are formatted directly, to the given precision (defaults to the calculator's)
+            - sequences of numbers as coordinates make a list of points, decimated within a tolerance of decimate pixels
+              (defaults to the calculator's) at the bounds() of each render (see Calculator.decimated())
             - substitute a custom variable in the sympy expression, then replace this later with the latex string of the point
         """
-        coords = [ sympy.latex(Statement.ref(expr)).replace('\\',r'\\') for expr in args ]
-        coords = f'({", ".join(coords)})'
-
-        return self.substitute(coords, cls=IndexedBaseValue)
+        if precision is None:
+            precision = self._root._precision
+        data = None
+        if len(args) == 2 and all(isinstance(arg, (list, tuple)) or getattr(arg, 'ndim', 0) == 1 for arg in args) \
+                and all(_number_strings(arg) is not None for arg in args):
+            curve = self._root._curve(decimate)
+            data,args = args,[ self.list(arg, precision=precision) for arg in args ]
+        coords = _format_numbers(args, precision)
+        if coords is None:
+            coords = ", ".join(render_latex(Statement.ref(expr)).replace('\\',r'\\') for expr in args)
+        coords = f'({coords})'
+
+        point = self.substitute(coords, cls=IndexedBaseValue)
+        self._root._literals[point.expr] = ('point', tuple(Statement.ref(expr) for expr in args))
+        if data is not None and curve is not None:
+            self._root._curves.append(('point', point, data, curve, precision))
+        return point
     
-    def list(self, values, *args, **kwargs):
+    def list(self, values, *args, precision=None, **kwargs):
         """
         Capture a list of values
             - sympy formats arrays as a matrix; we'll need to format manually
+            - plain numbers (including numpy arrays) are formatted directly, to the given precision (defaults to the calculator's)
             - substitute a custom variable in the sympy expression, then replace this later with the latex string of the list
         """
-        values = [ sympy.latex(Statement.ref(expr)).replace('\\',r'\\') for expr in values ]
-        values = f'[{", ".join(values)}]'
-
-        return self.substitute(values, cls=IndexedBaseValue)
+        if not isinstance(values, (list, tuple)) and 'shape' not in dir(values):
+            values = list(values)
+        if len(values) > _LIST_CAP:
+            warnings.warn(f'desmos lists are limited to {_LIST_CAP} elements, this one has {len(values)}: see ingest()', stacklevel=2)
+        if precision is None:
+            precision = self._root._precision
+        numbers = _format_numbers(values, precision)
+        literal = ('list', values)
+        if numbers is None:
+            literal = None
+            values = [ render_latex(Statement.ref(expr)).replace('\\',r'\\') for expr in values ]
+            numbers = ", ".join(values)
+        values = f'[{numbers}]'
+
+        values = self.substitute(values, cls=IndexedBaseValue)
+        if literal is not None:
+            self._root._literals[values.expr] = literal
+        return values
     
     def range(self, *args):
         """
@@ -158,10 +749,137 @@ class ExpressionCollection(object):
         """
         bounds = list(args)
         bounds[-1] -= 1 # python is exclusive, desmos is inclusive
-        bounds = [ sympy.latex(Statement.ref(expr)).replace('\\',r'\\') for expr in bounds ]
+        literal = ('range', Statement.ref(0 if len(bounds) < 2 else bounds[0]), Statement.ref(bounds[-1]))
+        span = literal[2] - literal[1] + 1
+        if getattr(sympy.sympify(span), 'is_Integer', False) and span > _LIST_CAP:
+            warnings.warn(f'desmos lists are limited to {_LIST_CAP} elements, this range has {span}', stacklevel=2)
+        bounds = [ render_latex(Statement.ref(expr)).replace('\\',r'\\') for expr in bounds ]
         bounds = f'[{0 if len(bounds) < 2 else bounds[0]}...{bounds[-1]}]'
 
-        return self.substitute(bounds, cls=IndexedBaseValue)
+        bounds = self.substitute(bounds, cls=IndexedBaseValue)
+        self._root._literals[bounds.expr] = literal
+        return bounds
+
+    def table(self, data, names=None, precision=None, decimate=None, **kwargs):
+        """
+        Add a native desmos table
+            - data is a 2-D array (rows x columns), a dict of columns, or the path of a CSV file with a header row
+            - names default to the dict keys or CSV header, otherwise to x_1, y_1, y_2, ...
+            - numeric rows are decimated within a tolerance of decimate pixels, keeping the points of any curve (x_1, y_k) needs
+              (defaults to the calculator's) at the bounds() of each render (see Calculator.decimated())
+            - columns are emitted as plain JSON values, with no latex generation for the data
+            - new column names can be used in other expressions (e.g. calc.y_1[3], calc.y_1.length)
+        """
+        if precision is None:
+            precision = self._root._precision
+
+        if isinstance(data, (str, os.PathLike)):
+            import csv
+            with open(data, newline='') as f:
+                rows = csv.reader(f)
+                header = next(rows)
+                columns = [ list(map(float, column)) for column in zip(*rows) ]
+            if names is None:
+                names = [ name.strip() for name in header ]
+        elif isinstance(data, dict):
+            if names is None:
+                names = list(data.keys())
+            columns = list(data.values())
+        else:
+            if 'T' in dir(data):
+                columns = list(data.T)
+            else:
+                columns = list(zip(*data))
+        if names is None:
+            names = ['x_1'] + ['y_%d'%(i+1) for i in range(len(columns)-1)]
+        if len(names) != len(columns):
+            raise ValueError(f'table() received {len(names)} names for {len(columns)} columns')
+        curve = None
+        if len(columns) > 1 and all(_number_strings(column) is not None for column in columns):
+            curve = self._root._curve(decimate)
+
+        values = []
+        for column in columns:
+            strings = _number_strings(column, precision)
+            if strings is None:
+                strings = [ render_latex(Statement.ref(expr)) for expr in column ]
+            values.append(strings)
+
+        for name in names:
+            if name not in self._root._cache:
+                self._root._cache[name] = IndexedBase(name)
+
+        table = self.set(Table(names, values), **kwargs)
+        if curve is not None:
+            self._root._curves.append(('table', table, columns, curve, None))
+        return table
+
+    def ingest(self, source, names=None, shard=_LIST_CAP, precision=None):
+        """
+        Define lists from a dataset too long for desmos lists, streaming it shard elements at a time
+            - source is the path of a CSV file with a header row, or a 1-D or 2-D array (rows x columns), e.g. np.memmap
+            - names default to the CSV header, otherwise to x_1, y_1, y_2, ...
+            - a column that fits in a shard is defined as a plain list; a longer one is split into the lists
+              name_{s1}, name_{s2}, ... and returned as a ShardedList, which indexes and sums like one list
+            - returns the list of each column (a single one for a 1-D array)
+        """
+        if isinstance(source, (str, os.PathLike)):
+            import csv
+            f = open(source, newline='')
+            rows = csv.reader(f)
+            header = [ name.strip() for name in next(rows) ]
+            if names is None:
+                names = header
+            def blocks():
+                with f:
+                    while True:
+                        block = list(itertools.islice(rows, shard))
+                        if not block:
+                            return
+                        yield [ list(map(float, column)) for column in zip(*block) ]
+            single = False
+        else:
+            single = getattr(source, 'ndim', None) == 1 or (
+                'ndim' not in dir(source) and len(source) and '__len__' not in dir(source[0]))
+            def blocks():
+                for start in range(0, len(source), shard):
+                    block = source[start:start+shard]
+                    if single:
+                        yield [block]
+                    elif 'T' in dir(block):
+                        yield list(block.T)
+                    else:
+                        yield list(zip(*block))
+
+        blocks = blocks()
+        first = next(blocks, None)
+        if first is None:
+            raise ValueError('ingest() received no rows')
+        if names is None:
+            names = ['x_1'] + ['y_%d'%(i+1) for i in range(len(first)-1)]
+        if len(names) != len(first):
+            raise ValueError(f'ingest() received {len(names)} names for {len(first)} columns')
+        second = next(blocks, None)
+
+        if second is None:
+            for name,column in zip(names, first):
+                self.__setattr__(name, self.list(column, precision=precision))
+            lists = [ self._root._cache[name] for name in names ]
+        else:
+            shards = [ [] for name in names ]
+            starts = []
+            length = 0
+            for block in itertools.chain((first, second), blocks):
+                starts.append(length)
+                for name,column,column_shards in zip(names, block, shards):
+                    shard_name = ShardedList.shard_name(name, len(starts))
+                    self.__setattr__(shard_name, self.list(column, precision=precision))
+                    column_shards.append(self._root._cache[shard_name])
+                length += len(block[0])
+            lists = [ ShardedList(column_shards, starts, length) for column_shards in shards ]
+            for name,handle in zip(names, lists):
+                self._root._cache[name] = handle
+        return lists[0] if single else lists
 
 class Calculator(ExpressionCollection):
     def __init__(self, size=None, **kwargs):
@@ -172,6 +890,22 @@ class Calculator(ExpressionCollection):
             url_fmt - location of Desmos library, parameterized with {"rev", "key"}
             key - Desmos key
             rev - Version of Desmos library
+            assets - a local copy of the Desmos library (calculator.js), or a directory to cache copies in,
+                     one per rev (fetched from url on first use); pages then load it by relative path
+            inline - with assets, embed the library in the page instead (pages shown as a data URL always do)
+            precision - significant digits for numeric lists and points, or 'repr' for exact values (default 15, or 6 in compact mode)
+            simplify - simplification of combined regions: 'none', 'fast' or 'full' (default)
+            simplify_budget - seconds allowed for 'full' simplification before keeping the unsimplified form
+            mode - 'expressions' (default) emits one setExpression() call per expression;
+                   'state' builds the whole desmos state in python and emits a single setState()
+                   'compact' is a minified 'state' page, with repeated latex stored once
+            deflate - in compact mode, embed the state gzipped, for the page to inflate (needs a browser with DecompressionStream)
+            patchable - emit the JS that applies patch() to the page (pages of show(update=True) always have it)
+            workers - render expressions in a pool of this many processes (see prerender())
+            cse - define subexpressions repeated across expressions once, as helper variables (see hoist())
+            precompute - evaluate definitions of concrete values in python, emitting the resulting numbers (see precompute())
+            decimate - tolerance in pixels (True for half a pixel) to simplify curves of data within, at the graph's bounds()
+                       and size when rendering: points of lists, tables and precomputed points (see decimate())
             **others - remaining kwargs are forwarded to Desmos as API options (see https://www.desmos.com/api/v1.9/docs/index.html)
         """
         if size:
@@ -180,15 +914,33 @@ class Calculator(ExpressionCollection):
             self._width = 1080
             self._height = 360
 
+        self._mode = kwargs.pop('mode', 'expressions')
+        self._deflate = kwargs.pop('deflate', False)
+        self._patchable = kwargs.pop('patchable', False)
+        self._token = secrets.token_hex(16) # authenticates patches posted to the page
+        self._precision = kwargs.pop('precision', 6 if self._mode == 'compact' else 15)
+        self._simplify = _check_policy(kwargs.pop('simplify', 'full'))
+        self._simplify_budget = kwargs.pop('simplify_budget', None)
+        self._workers = kwargs.pop('workers', None)
+        self._cse = kwargs.pop('cse', False)
+        self._precompute = kwargs.pop('precompute', False)
+        self._holes = frozenset() # names of the variables template() is leaving as holes
+        self._params = frozenset() # parameters of the functions being defined (see _defining())
+        self._decimate = kwargs.pop('decimate', None)
+        self._assets = kwargs.pop('assets', None)
+        self._inline = kwargs.pop('inline', False)
+        if self._mode not in ('expressions', 'state', 'compact'):
+            raise ValueError(f'unknown output mode "{self._mode}"')
         kwargs,self._url = self.url_from_kwargs(**kwargs)
 
         # Overried default Desmos options, unless specified by user
         ## kwargs.setdefault('expressionsCollapsed', True)
-        self._options = json.dumps(kwargs)
+        self._options = _script_safe(json.dumps(kwargs))
 
         self._root = self
         self._cache = dict([(var,Statement(var)) for var in ('x','y','r','theta')])
         self._substitutions = {}
+        self._interned = {} # latex value -> placeholder
         for var in ('pi','e'):
             self.substitute(var)
         self._customs = dict(self._substitutions)
@@ -198,10 +950,21 @@ class Calculator(ExpressionCollection):
     def clear(self, init=False):
         self._next_id = 0
         self._obj_ids = {}
+        self._last_render = ({}, None)
+        self._display = None
+        self._helpers = []
+        self._hoist_memo = (None, ([], {}))
+        self._precompute_memo = (None, {})
+        self._precompute_fns = set()
+        self._literals = {}
+        self._curves = [] # lists of points and tables to decimate when rendering: (source, point or table, columns, pixels, precision)
+        self._decimation_memo = (None, ({}, {}))
+        self._decimated = {}
         if not init:
             for folder in self._folders:
                 folder.clear()            
             self._substitutions = dict(self._customs)
+            self._interned = dict((value,var) for var,value in self._customs.items())
         self._folders = []
         self._children = []
 
@@ -212,8 +975,43 @@ class Calculator(ExpressionCollection):
             rev = kwargs.pop('rev', 'v1.10')
             key = kwargs.pop('key', 'dcb31709b452b1cf9dc26972add0fda6')
             url = url_fmt % {'rev': rev, 'key': key}
+            self._asset_name = 'calculator-%s.js'%re.sub(r'[^\w.-]', '_', str(rev))
+        else:
+            self._asset_name = 'calculator-%s.js'%hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
         return kwargs,url
 
+    def asset_path(self):
+        """ Path of the local copy of the Desmos library, fetched into the assets directory if needed (see __init__). """
+        if not os.path.isdir(self._assets):
+            return self._assets
+        path = os.path.join(self._assets, self._asset_name)
+        if not os.path.exists(path):
+            import urllib.parse,urllib.request
+            if urllib.parse.urlsplit(self._url).scheme not in ('http', 'https'):
+                raise ValueError(f'the Desmos library is only fetched over http(s), not from {self._url}')
+            with urllib.request.urlopen(self._url) as response:
+                library = response.read()
+            # write aside and rename, so concurrent renders never read a partial copy
+            partial = f'{path}.{os.getpid()}.part'
+            with open(partial, 'wb') as f:
+                f.write(library)
+            os.replace(partial, path)
+        return path
+
+    def library(self, relative_to=None, inline=None):
+        """
+        The <script> tag that loads the Desmos library
+            - from url, unless assets is set
+            - with assets, from the local copy by its path relative to the page's directory (relative_to, default the current directory),
+              or embedded in the page with inline (defaults to the calculator's)
+        """
+        if self._assets is None:
+            return _library_fmt%self._url
+        path = self.asset_path()
+        if inline or (inline is None and self._inline):
+            return '<script>\n%s\n</script>'%_read_asset(path, os.stat(path).st_mtime_ns).replace('</script', '<\\/script')
+        return _library_fmt%os.path.relpath(path, relative_to or os.curdir).replace(os.sep, '/')
+
     def folder(self, name):
         folder = Folder(parent=self, name=name)
         self._children.append(folder)
@@ -225,6 +1023,21 @@ class Calculator(ExpressionCollection):
             self._children.append(folder)
             self._folders.append(folder)            
 
+    _placeholder = re.compile(r'v_\{custom\d+\}')
+
+    def resolve(self, text):
+        """
+        Replace every substitution placeholder in text, in a single pass.
+            - placeholders are matched whole (including the closing brace), so no name can shadow another
+        """
+        subs = self._substitutions
+        if _profile is None:
+            return self._placeholder.sub(lambda m: subs.get(m.group(0), m.group(0)), text)
+        text,count = _timed('resolve', self._placeholder.subn, lambda m: subs.get(m.group(0), m.group(0)), text)
+        _profile.resolved += count
+        _profile.substitutions = len(subs)
+        return text
+
     def get_id(self, obj):
         """
         As the root of the tree, Calculator tracks the ID of each node
@@ -238,35 +1051,791 @@ class Calculator(ExpressionCollection):
     def bounds(self, left=0, right=0, bottom=10, top=10):
         self._bounds = (left, right, bottom, top)
     
-    @property
-    def html(self):
-        html = []
+    def expression_states(self):
+        """
+        Generate the desmos state of each expression, in order
+            - folder members follow their folder, linked by folderId
+            - substitution placeholders are left in place (see resolve())
+        """
+        for child in self._helpers + self._children:
+            item = dict(child.expression_state, id=str(self.get_id(child)))
+            yield item
+            if isinstance(child, Folder):
+                child._child_ids = list(self.get_id(member) for member in child._children)
+                for member,member_id in zip(child._children, child._child_ids):
+                    yield dict(member.expression_state, id=str(member_id), folderId=item['id'])
+
+    def pixel_size(self):
+        """ Graph units per pixel along x and y, at the graph's bounds() (or the default view of x from -10 to 10) and size """
+        if not self._bounds:
+            return 20 / self._width, 20 / self._width
+        left,right,bottom,top = self._bounds
+        return (right - left) / self._width, (top - bottom) / self._height
+
+    def _curve(self, pixels):
+        """ The tolerance in pixels to decimate a curve within: pixels, or by default the calculator's; None if no decimation applies """
+        if pixels is None:
+            pixels = self._decimate
+        if pixels is None or pixels is False:
+            return None
+        return 0.5 if pixels is True else pixels
+
+    def _decimation(self, x, ys, pixels, source, curve):
+        """
+        The indices of the points of the curves (x, y) for each y to keep within a tolerance of pixels (see decimate())
+            - pixels=None takes the calculator's tolerance; None if no decimation applies
+            - curve identifies the curve in decimated()
+        """
+        pixels = self._curve(pixels)
+        if pixels is None:
+            return None
+        import numpy
+        ux,uy = self.pixel_size()
+        x = numpy.asarray(x, dtype=float) / ux
+        kept = numpy.unique(numpy.concatenate([ decimate(x, numpy.asarray(y, dtype=float) / uy, pixels) for y in ys ]))
+        record = (source, len(x), len(kept))
+        self._decimated[curve] = record
+        if _profile is not None:
+            _profile.decimated.append(record)
+        return kept
+
+    def _decimations(self):
+        """
+        Decimate the lists of points and tables at the current bounds() and size, as rendering them
+            - returns the latex of each list of points (by placeholder), and the columns of each table, keeping the decimated points
+        """
+        key = (self._bounds, self._width, self._height, len(self._curves))
+        if self._decimation_memo[0] == key:
+            return self._decimation_memo[1]
+        lists,columns = {},{}
+        for i,(source,target,data,pixels,precision) in enumerate(self._curves):
+            kept = self._decimation(data[0], data[1:], pixels, source, (source, i)).tolist()
+            if source == 'point':
+                lists[str(target.expr)] = '(%s)'%', '.join('[%s]'%_format_numbers([ values[k] for k in kept ], precision) for values in data)
+            else:
+                columns[target] = [ dict(column, values=[ column['values'][k] for k in kept ]) for column in target.columns ]
+        self._decimation_memo = (key, (lists, columns))
+        return lists, columns
+
+    def decimated(self):
+        """ The curves decimated by the last render, as (source, points, kept) tuples, source being 'point', 'table' or 'precompute' """
+        return list(self._decimated.values())
+
+    def graph_state(self):
+        if not self._bounds:
+            return {}
+        left,right,bottom,top = self._bounds
+        return {'viewport': {'xmin': left, 'xmax': right, 'ymin': bottom, 'ymax': top}}
+
+    def state(self):
+        """ Build the desmos state of all children, as consumed by calculator.setState() """
+        with self._rewriting():
+            state = {'expressions': {'list': list(self.expression_states())}}
+        if self._bounds:
+            state['graph'] = self.graph_state()
+        return state
+
+    def _rendered_children(self):
         for child in self._children:
-            self.get_id(child)
-            html.append(child.html)
-        html = '\n  '.join(html)
-        for key,sub in self._root._substitutions.items():
-            html = html.replace(key, sub)
-        tree = dict((self.get_id(f),f.child_ids) for f in self._folders)
+            for expr in (child._children if isinstance(child, Folder) else (child,)):
+                if isinstance(expr, (Equality, Inequality, Boolean)):
+                    yield expr
+
+    def hoist(self, exclude=()):
+        """
+        Find the subexpressions repeated across expressions (sympy.cse), to define once as helper variables h_{1}, h_{2}, ...
+            - subexpressions of x, y, r, theta, function parameters or sum indices stay in place, as desmos can't define them globally
+            - subexpressions of a single operation (e.g. 2\\pi) stay in place, as a helper wouldn't be shorter
+            - returns (the helper definitions, the latex of each expression rewritten to use them), leaving out the expressions in exclude
+        """
+        exprs = [ expr for expr in self._rendered_children() if expr not in exclude ]
+        keys = tuple((expr, expr.key) for expr in exprs)
+        if self._hoist_memo[0] == keys:
+            return self._hoist_memo[1]
+
+        forms = [ expr.form for expr in exprs ]
+        ignore = set(sympy.Symbol(var) for var in ('x', 'y', 'r', 'theta'))
+        for form in forms:
+            if isinstance(form, sympy.Eq) and isinstance(form.lhs, sympy.core.function.AppliedUndef):
+                ignore.update(form.lhs.args)
+            for summation in form.atoms(sympy.Sum):
+                ignore.update(summation.variables)
+        # the printed names in use anywhere on the page (e.g. h_1 and h_{1} both print h_{1})
+        symbols = set(sympy.Symbol(name) for name in self._cache)
+        for expr in self._rendered_children():
+            symbols.update(expr.form.free_symbols)
+            symbols.update(sympy.Symbol(call.func.__name__) for call in expr.form.atoms(sympy.core.function.AppliedUndef))
+        names = set(render_latex(symbol) for symbol in symbols)
+        replacements,reduced = sympy.cse(forms, symbols=sympy.numbered_symbols(cls=sympy.Dummy), ignore=ignore, order='none')
+
+        helper_names = ( sympy.Symbol(f'h_{{{i}}}') for i in itertools.count(1) if f'h_{{{i}}}' not in names )
+        inline = {}
+        definitions = []
+        for symbol,value in replacements:
+            value = value.xreplace(inline)
+            if sympy.count_ops(value) < 2:
+                inline[symbol] = value
+            else:
+                inline[symbol] = next(helper_names)
+                definitions.append((inline[symbol], value))
+        cache = dict(((helper.expr.lhs, helper.expr.rhs), helper) for helper in self._helpers)
+        helpers = [ cache.get(definition) or Equality(*definition) for definition in definitions ]
+        latex = {}
+        for expr,form,rewritten in zip(exprs, forms, reduced):
+            rewritten = rewritten.xreplace(inline)
+            if rewritten != form:
+                latex[expr] = expr.render(rewritten)
+        self._hoist_memo = (keys, (helpers, latex))
+        return helpers, latex
+
+    def _list_lengths(self, base):
+        """ The lengths of the list assigned to base (an IndexedBase): base.length, and its number of elements if known """
+        lengths = [StatementAttribute.AttrSymbol(f'{base}.length')]
+        for expr in self._rendered_children():
+            if isinstance(expr, Equality) and expr.expr.lhs == base:
+                literal = self._literals.get(expr.expr.rhs)
+                if literal is not None and literal[0] == 'list':
+                    lengths.append(sympy.Integer(len(literal[1])))
+        return lengths
+
+    def _list_elements(self, expr, index):
+        """ The elements of lists picked by index in expr, including in the coordinates of its points """
+        for element in expr.atoms(sympy.Indexed, ShardedList.Element):
+            if index in element.free_symbols:
+                yield element
+        for symbol in expr.atoms(sympy.Symbol):
+            literal = self._literals.get(symbol)
+            if literal is not None and literal[0] == 'point':
+                for coord in literal[1]:
+                    yield from self._list_elements(sympy.sympify(coord), index)
+
+    @contextlib.contextmanager
+    def _defining(self, args):
+        """ Inside the block, the body of a function of args is being built. """
+        previous = self._params
+        self._params = previous | set(sympy.Symbol(str(arg)) for arg in args)
+        try:
+            yield
+        finally:
+            self._params = previous
+
+    def _scalar(self, expr, seen=frozenset()):
+        """
+        Whether expr is known to be a number (or point), assuming the symbols in seen are
+            - numbers are built of numbers, points, x and y, list elements, total()s, lengths and variables defined from them
+            - calls of custom functions and parameters of the functions being defined may be lists
+        """
+        if expr.atoms(sympy.core.function.AppliedUndef):
+            return False
+        # an element of a list is a number if its index is, a total() always is
+        numbers = dict((element, element.args[0] if isinstance(element, ShardedList.Element) else sympy.Add(*element.indices))
+                       for element in expr.atoms(sympy.Indexed, ShardedList.Element))
+        numbers.update((total, sympy.Integer(0)) for total in expr.atoms(self.Total))
+        expr = expr.xreplace(numbers)
+        seen = seen.union(*(summation.variables for summation in expr.atoms(sympy.Sum)))
+        definitions = None
+        for symbol in expr.free_symbols - seen:
+            if symbol in self._params:
+                return False
+            if isinstance(symbol, StatementAttribute.AttrSymbol):
+                if not symbol.name.endswith('.length'):
+                    return False
+                continue
+            if symbol.name in ('x', 'y', 'r', 'theta'):
+                continue
+            literal = self._literals.get(symbol)
+            if literal is not None:
+                if literal[0] != 'point' or not all(self._scalar(sympy.sympify(coord), seen) for coord in literal[1]):
+                    return False
+                continue
+            if definitions is None:
+                definitions = dict((expr.expr.lhs, expr.expr.rhs) for expr in self._rendered_children() if isinstance(expr, Equality))
+            if symbol not in definitions or not self._scalar(definitions[symbol], seen | {symbol}):
+                return False
+        return True
+
+    def _broadcast(self, expr, index, lower, upper, force=False):
+        """
+        Lower the summand expr of a sum over index to list broadcasting: each element m[index+k] becomes the list m, as in total(m)
+            - the elements of a sharded list (see ingest()) become each of its shards in turn, adding up one total() per shard
+            - returns None if index is used otherwise, or unless force, if the bounds don't span every list
+              or anything else in expr may be a list (see _scalar())
+        """
+        offsets,bases,layouts = set(),set(),set()
+        for element in self._list_elements(expr, index):
+            if isinstance(element, sympy.Indexed):
+                position = element.indices[0] if len(element.indices) == 1 else None
+                bases.add(element.base)
+            else:
+                position = element.args[0]
+                layouts.add(element.args[2:]) # (starts, length)
+            offset = None if position is None else position - index
+            if offset is None or not offset.is_Integer:
+                return None
+            offsets.add(offset)
+        # sharded lists can't be mixed with other lists, or sharded differently
+        if len(offsets) != 1 or len(layouts) > 1 or (layouts and bases):
+            return None
+        offset = offsets.pop()
+        span = upper + offset + 1
+        if not force:
+            if lower + offset != 0:
+                return None
+            if layouts:
+                if span != list(layouts)[0][1]:
+                    return None
+            else:
+                lengths = dict((base, self._list_lengths(base)) for base in bases)
+                spans = (span, span.xreplace(dict(known for known in lengths.values() if len(known) == 2))) # (base.length, number)
+                if not all(set(spans) & set(known) for known in lengths.values()):
+                    return None
+
+            if not self._scalar(expr, frozenset([index])):
+                return None
+
+        shards = range(len(list(layouts)[0][0])) if layouts else (None,)
+        terms = [ self._lowered(expr, index, shard) for shard in shards ]
+        if any(index in term.free_symbols for term in terms):
+            return None
+        return sympy.Add(*(self.Total(term) for term in terms))
+
+    def _lowered(self, expr, index, shard=None):
+        """ expr with each element picked by index replaced by its whole list, or by the given shard of a sharded list """
+        replace = {}
+        for element in expr.atoms(sympy.Indexed, ShardedList.Element):
+            if index in element.free_symbols:
+                replace[element] = element.base.label if shard is None else element.args[1][shard].label
+        expr = expr.xreplace(replace)
+        points = {}
+        for symbol in expr.atoms(sympy.Symbol):
+            literal = self._literals.get(symbol)
+            if literal is not None and literal[0] == 'point':
+                coords = [ self._lowered(sympy.sympify(coord), index, shard) for coord in literal[1] ]
+                if coords != [ sympy.sympify(coord) for coord in literal[1] ]:
+                    points[symbol] = self.point(*coords).expr
+        return expr.xreplace(points)
+
+    def _sliders(self):
+        """ Variables that stay adjustable in the page: those configured with slider state, and the holes of a template. """
+        return set( expr.expr.lhs for expr in self._rendered_children()
+                    if isinstance(expr, Equality) and ('sliderBounds' in getattr(expr, 'state', ()) or 'playing' in getattr(expr, 'state', ())
+                                                       or str(expr.expr.lhs) in self._holes) )
+
+    def precompute(self):
+        """
+        Evaluate definitions of concrete values with numpy (sympy.lambdify), for desmos to plot the resulting numbers, points or lists
+            - applies to definitions set with precompute=True, assigning an application of a function defined with precompute=True,
+              or any definition with Calculator(precompute=True), unless set with precompute=False
+            - concrete values are numbers, point(), list() and range() literals, and variables defined from them, through functions;
+              variables configured as sliders (sliderBounds or playing) or left as holes by template() are not,
+              so definitions depending on them stay symbolic
+            - definitions that can't be evaluated (e.g. of x or y, or of functions desmos defines) stay symbolic
+            - returns the latex of each evaluated definition
+        """
+        exprs = [ expr for expr in self._rendered_children() if isinstance(expr, Equality) ]
+        keys = (self._holes, self._bounds, self._width, self._height) + tuple((expr, expr.key, getattr(expr, 'precompute', None), tuple(getattr(expr, 'state', {}).items())) for expr in exprs)
+        if self._precompute_memo[0] == keys:
+            return self._precompute_memo[1]
+
+        sliders = self._sliders()
+        definitions,functions = {},{}
+        for expr in exprs:
+            lhs,rhs = expr.expr.lhs,expr.expr.rhs
+            if isinstance(lhs, sympy.core.function.AppliedUndef):
+                functions[lhs.func] = (lhs.args, rhs)
+            elif isinstance(lhs, sympy.IndexedBase):
+                definitions[lhs.label] = rhs
+            elif lhs not in sliders:
+                definitions[lhs] = rhs
+
+        latex = {}
+        for expr in exprs:
+            lhs,rhs = expr.expr.lhs,expr.expr.rhs
+            if not isinstance(lhs, sympy.Symbol) or rhs.is_Atom:
+                continue
+            precompute = getattr(expr, 'precompute', None)
+            if precompute is None:
+                precompute = self._precompute or any(
+                    call.func in self._precompute_fns for call in rhs.atoms(sympy.core.function.AppliedUndef))
+            if not precompute:
+                continue
+            try:
+                value = self._evaluate(rhs, definitions, functions)
+            except Exception: # not concrete, or not something numpy evaluates
+                continue
+            latex[expr] = f'{render_latex(lhs)} = {value}'
+        self._precompute_memo = (keys, latex)
+        return latex
+
+    def _evaluate(self, expr, definitions, functions):
+        """ The latex of the numbers expr evaluates to, raising _NotConcrete if it depends on anything but concrete values. """
+        import numpy
+        components = []
+        points = []
+        for c in (0, 1):
+            inlined = self._expand(expr, c, definitions, functions, points)
+            bindings = {}
+            for symbol in inlined.atoms(sympy.Symbol):
+                if symbol in self._literals:
+                    bindings[symbol] = sympy.Symbol(f'_literal{len(bindings)}')
+            inlined = inlined.xreplace(bindings)
+            bound = set(bindings.values()).union(*(summation.variables for summation in inlined.atoms(sympy.Sum)))
+            if inlined.atoms(sympy.core.function.AppliedUndef) or inlined.atoms(sympy.Symbol) - bound:
+                raise _NotConcrete(expr)
+            fn = sympy.lambdify(list(bindings.values()), inlined, 'numpy')
+            with numpy.errstate(all='ignore'):
+                components.append(numpy.asarray(fn(*(self._literal_value(symbol, definitions, functions) for symbol in bindings))))
+            if not points: # a number or list, rather than points: the y coordinate isn't needed
+                break
+        components = numpy.broadcast_arrays(*components)
+        if components[0].ndim > 1 or any(component.dtype.kind not in 'iuf' for component in components):
+            raise _NotConcrete(expr)
+
+        if points and components[0].ndim:
+            kept = self._decimation(components[0], components[1:], None, 'precompute', ('precompute', expr))
+            if kept is not None:
+                components = [ component[kept] for component in components ]
+        strings = [ _number_strings(component.reshape(-1), self._precision) for component in components ]
+        if any(string is None for string in strings): # not finite
+            raise _NotConcrete(expr)
+        values = [ f'({", ".join(coords)})' for coords in zip(*strings) ] if points else strings[0]
+        return f'[{", ".join(values)}]' if components[0].ndim else values[0]
+
+    def _expand(self, expr, c, definitions, functions, points=None, params=(), depth=0):
+        """
+        Replace in expr the variables by their definitions, the applications of functions by their bodies,
+        and the points by their coordinate c (appending them to points)
+        """
+        if depth > 64:
+            raise _NotConcrete(expr)
+        replace = {}
+        for symbol in expr.atoms(sympy.Symbol):
+            if symbol in params:
+                continue
+            if symbol in definitions:
+                replace[symbol] = self._expand(definitions[symbol], c, definitions, functions, points, depth=depth+1)
+            elif self._literals.get(symbol, ('',))[0] == 'point':
+                if points is None:
+                    raise _NotConcrete(expr)
+                points.append(symbol)
+                coord = sympy.sympify(self._literals[symbol][1][c])
+                replace[symbol] = self._expand(coord, c, definitions, functions, points, params, depth+1)
+        expr = expr.xreplace(replace)
+
+        def call(*args, fn=None):
+            params,body = functions[fn]
+            body = self._expand(body, c, definitions, functions, points, params, depth+1)
+            return body.xreplace(dict(zip(params, args)))
+        return expr.replace(lambda e: isinstance(e, sympy.core.function.AppliedUndef) and e.func in functions,
+                            lambda e: call(*e.args, fn=e.func))
+
+    def _literal_value(self, symbol, definitions, functions):
+        import numpy
+        literal = self._literals[symbol]
+        if literal[0] == 'list':
+            return numpy.asarray(literal[1], dtype=float)
+        if literal[0] == 'range':
+            lower,upper = ( self._expand(sympy.sympify(bound), 0, definitions, functions) for bound in literal[1:] )
+            if not (lower.is_Integer and upper.is_Integer):
+                raise _NotConcrete(symbol)
+            return numpy.arange(int(lower), int(upper)+1)
+        raise _NotConcrete(symbol)
+
+    @contextlib.contextmanager
+    def _rewriting(self):
+        """ With cse, precompute or decimation, emit the rewritten expressions (and hoisted helpers, and decimated curves) inside the block. """
+        global _overrides
+        rewriting = (self._cse or self._precompute or self._precompute_fns or
+                     any(getattr(expr, 'precompute', None) for expr in self._rendered_children()))
+        if not (rewriting or self._curves):
+            yield
+            return
+        latex = self.precompute() if rewriting else {}
+        if self._cse:
+            self._helpers,hoisted = self.hoist(exclude=latex)
+            latex = {**hoisted, **latex}
+        lists,columns = self._decimations()
+        previous,substitutions = _overrides,dict((var, self._substitutions[var]) for var in lists) # the points' as built
+        _overrides = {**latex, **columns, **(previous or {})}
+        self._substitutions.update(lists)
+        try:
+            yield
+        finally:
+            _overrides = previous
+            self._substitutions.update(substitutions)
+
+    _hole = re.compile(r'\\u0000(\w+)\\u0000')
+
+    def template(self, *names):
+        """
+        Render the page once, with the values of the given variables (e.g. calc.a = 0.3) left as holes
+            - returns a Template, which fills in other values without rendering again
+            - definitions depending on the holes are never precomputed, as they would keep the rendered values
+        """
+        global _overrides
+        if self._deflate:
+            raise ValueError('templates need deflate=False, as holes must be found in the page')
+        holes,defaults = {},{}
+        for expr in self._rendered_children():
+            if isinstance(expr, Equality) and str(expr.expr.lhs) in names:
+                name = str(expr.expr.lhs)
+                holes[expr] = f'{render_latex(expr.expr.lhs)} = \x00{name}\x00'
+                defaults[name] = self.resolve(json.dumps(render_latex(expr.expr.rhs))[1:-1])
+        missing = set(names) - set(defaults)
+        if missing:
+            raise ValueError(f'no definition of {", ".join(sorted(missing))} to make a template of')
+
+        previous,last_render,previous_holes = _overrides,self._last_render,self._holes
+        _overrides = {**(previous or {}), **holes}
+        self._holes = previous_holes | set(names)
+        try:
+            parts = self._hole.split(self.html)
+        finally:
+            _overrides,self._last_render,self._holes = previous,last_render,previous_holes
+        return Template(parts, defaults, self._precision)
+
+    def prerender(self, workers=None):
+        """
+        Render the latex of every stale expression in a pool of worker processes, ahead of emitting the page
+            - ids are still assigned and substitutions resolved in order when emitting, so the output is unchanged
+            - expressions that can't be sent to a worker (e.g. unpicklable custom symbols) are rendered locally
+            - the pool is started on the first render and kept for the next ones, by every calculator asking for as many workers
+        """
+        pending = []
+        for expr in self._rendered_children():
+            key = expr.key
+            rendered = getattr(expr, '_rendered', None)
+            if rendered is None or rendered[0] != key:
+                pending.append((expr, key))
+        if len(pending) < 2:
+            return
+
+        from concurrent.futures.process import BrokenProcessPool
+        pool = _pool(workers)
+        futures = [ pool.submit(_render_child, expr) for expr,key in pending ]
+        for (expr,key),future in zip(pending, futures):
+            try:
+                latex = future.result()
+            except BrokenProcessPool: # a worker died: start a new pool for the next render
+                _pool(workers, broken=pool)
+                latex = expr.render()
+            except Exception:
+                latex = expr.render()
+            expr._rendered = (key, latex)
+
+    def iter_html(self, relative_to=None, inline=None, patchable=None):
+        """
+        Generate the page in chunks, one per expression, with substitutions resolved
+            - lets save() stream to a file without holding the whole page in memory
+            - relative_to and inline locate the Desmos library (see library())
+            - patchable overrides the calculator's (see __init__)
+        """
+        if self._workers:
+            self.prerender(self._workers)
+        head_fmt = _head_fmt
+        if self._patchable if patchable is None else patchable:
+            head_fmt += _patch_fmt%{'token':json.dumps(self._token)}
+        # in compact mode, only minify our template: an inlined library is emitted as is
+        if self._mode == 'compact':
+            head_fmt = _minify(head_fmt)
+        head = head_fmt%{'library':self.library(relative_to, inline), 'options':self._options}
+        with self._rewriting():
+            yield from self._iter_html(head)
+
+    def _iter_html(self, head):
+        if self._mode == 'compact':
+            yield from self._iter_compact(head)
+            return
+        yield head
+        if self._mode == 'state':
+            yield '  var state = {"expressions":{"list":['
+            start = time.perf_counter()
+            for i,item in enumerate(self.expression_states()):
+                chunk = (',' if i else '') + _script_safe(self.resolve(_timed('json', json.dumps, item, separators=(',',':'))))
+                if _profile is not None:
+                    _profile.children.append((item['id'], item.get('latex', item.get('title', item['type'])),
+                                              time.perf_counter() - start, len(chunk)))
+                yield chunk
+                start = time.perf_counter()
+            yield ']},"graph":%s};\n'%_script_safe(json.dumps(self.graph_state(), separators=(',',':')))
+            yield _state_tail_fmt
+            self._last_render = self._snapshot()
+            return
+
+        yield '  '
+        ids = []
+        for i,child in enumerate(self._helpers + self._children):
+            ids.append(str(self.get_id(child)))
+            start = time.perf_counter()
+            chunk = ('\n  ' if i else '') + _script_safe(self.resolve(child.html))
+            if _profile is not None:
+                name = child._name if isinstance(child, Folder) else child.expression_state.get('latex', 'table')
+                _profile.children.append((ids[-1], name, time.perf_counter() - start, len(chunk)))
+            yield chunk
+            if isinstance(child, Folder):
+                ids += map(str, child.child_ids)
+        tree = dict((str(self.get_id(f)),list(map(str, f.child_ids))) for f in self._folders)
         config = []
         if self._bounds:
             config += ['calculator.setMathBounds({left: %d, right: %d, bottom: %d, top: %d});'%self._bounds]
         config = '\n    '.join(config)
-        return html_fmt(self._url, html, self._options, tree, config)
-    
-    def save(self, filename, clear=True):
-        with open(filename, 'w') as f:
-            f.write(self.html)
+        yield _expressions_tail_fmt%{'ids':json.dumps(ids), 'folders':json.dumps(tree), 'config':config}
+        self._last_render = self._snapshot()
+
+    def _iter_compact(self, head):
+        yield head
+        start = time.perf_counter()
+        strings,index,items = [],{},[]
+        for item in self.expression_states():
+            if item['type'] == 'expression':
+                del item['type']
+                if item['latex'] not in index:
+                    index[item['latex']] = len(strings)
+                    strings.append(item['latex'])
+                item['latex'] = index[item['latex']]
+            items.append(item)
+        packed = {'latex': strings, 'list': items, 'graph': self.graph_state()}
+        payload = _script_safe(self.resolve(_timed('json', json.dumps, packed, separators=(',',':'))))
+        if self._deflate:
+            data = base64.b64encode(gzip.compress(payload.encode('utf-8'), mtime=0)).decode('ascii')
+            payload = _inflate_fmt%{'data':data}
+        else:
+            payload = 'desmospyLoad(%s);'%payload
+        if _profile is not None:
+            _profile.children.append(('*', f'{len(items)} expressions', time.perf_counter() - start, len(payload)))
+        yield payload
+        yield _compact_tail_fmt
+        self._last_render = self._snapshot()
+
+    @property
+    def html(self):
+        return ''.join(self.iter_html())
+
+    @contextlib.contextmanager
+    def profile(self, callback=None):
+        """
+        Collect RenderStats for everything rendered inside the block (from any calculator)
+            - callback, if given, receives the stats when the block exits, e.g. to export them
+
+            with calc.profile() as stats:
+                calc.save('graph.htm')
+            print(stats.report())
+        """
+        global _profile
+        stats = RenderStats()
+        previous,_profile = _profile,stats
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats.phases['total'] += time.perf_counter() - start
+            stats.bytes = sum(child[3] for child in stats.children)
+            _profile = previous
+            if callback is not None:
+                callback(stats)
+
+    def _snapshot(self):
+        items = dict((item['id'], hash(json.dumps(item))) for item in self.expression_states())
+        return items, json.dumps(self.graph_state())
+
+    def diff(self):
+        """
+        Compare the expressions against the last render (html, save, show or patch), then mark them as rendered
+            - returns (new or changed expression states, removed ids, graph state or None if unchanged)
+        """
+        previous,previous_graph = self._last_render
+        with self._rewriting():
+            current,graph = self._snapshot()
+            changed = [ item for item in self.expression_states() if previous.get(item['id']) != current[item['id']] ]
+        removed = [ id for id in previous if id not in current ]
+        self._last_render = (current, graph)
+        return changed, removed, (self.graph_state() if graph != previous_graph else None)
+
+    def patch(self, snippet=True):
+        """
+        Render only what changed since the last render, for a page rendered patchable (see __init__)
+            - as a JS snippet to run in the page (default), or as the JSON message its parent page can postMessage to it
+        """
+        changed,removed,graph = self.diff()
+        patch = {'set': changed, 'remove': removed, 'graph': graph or {}}
+        if not snippet:
+            patch = {'desmospy': patch, 'token': self._token}
+        patch = _script_safe(self.resolve(json.dumps(patch, separators=(',',':'))))
+        if snippet:
+            return f'desmospyPatch({patch});'
+        return patch
+
+    def dump(self, filename):
+        """
+        Save a snapshot of the calculator, to load() without building it again
+            - keeps the expressions with their rendered latex, substitutions, folders, configs and ids
+            - gzip compressed when filename ends with '.gz'
+        """
+        opener = gzip.open if str(filename).endswith('.gz') else open
+        with opener(filename, 'wb') as f:
+            pickle.dump(_snapshot_format(), f)
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a calculator from a snapshot written by dump()
+            - snapshots are pickles: loading one runs whatever code it names, so never load a file from an untrusted source
+            - refuses snapshots written by another version of desmospy
+        """
+        opener = gzip.open if str(filename).endswith('.gz') else open
+        with opener(filename, 'rb') as f:
+            if pickle.load(f) != _snapshot_format():
+                raise ValueError(f'{filename} is not a snapshot of this version of desmospy')
+            return pickle.load(f)
+
+    @classmethod
+    def cached(cls, build, *args, cache_dir='.desmospy-cache', **kwargs):
+        """
+        Return build(*args, **kwargs), loaded from a snapshot in cache_dir if the same inputs were built before
+            - the key hashes the source code of build, its pickled arguments (e.g. numpy arrays) and desmospy's own source;
+              files that build reads aren't part of it, so pass their contents rather than their names
+            - loads the cached snapshot with load(), so cache_dir must not be writable by anyone untrusted
+        """
+        import inspect
+        digest = hashlib.sha256(repr(_snapshot_format()).encode('utf-8'))
+        try:
+            digest.update(inspect.getsource(build).encode('utf-8'))
+        except (OSError, TypeError):
+            digest.update(f'{build.__module__}.{build.__qualname__}'.encode('utf-8'))
+        digest.update(pickle.dumps((args, sorted(kwargs.items())), protocol=4))
+        path = os.path.join(cache_dir, f'{digest.hexdigest()[:32]}.snapshot')
+        if os.path.exists(path):
+            return cls.load(path)
+        calc = build(*args, **kwargs)
+        os.makedirs(cache_dir, exist_ok=True)
+        # write aside and rename, so concurrent builds never load a partial snapshot
+        partial = f'{path}.{os.getpid()}.part'
+        calc.dump(partial)
+        os.replace(partial, path)
+        return calc
+
+    def save(self, filename, clear=True, compress=None):
+        """
+        Write the page to filename (a path or file object), streaming one expression at a time
+            - compress writes gzip; by default it is used when filename ends with '.gz'
+            - a path is written aside and renamed into place, so if rendering fails it keeps its previous page
+        """
+        if 'write' in dir(filename):
+            name = getattr(filename, 'name', None)
+            for chunk in self.iter_html(os.path.dirname(name) if isinstance(name, str) else None):
+                filename.write(chunk)
+        else:
+            if compress is None:
+                compress = str(filename).endswith('.gz')
+            with _writing(filename, compress) as f:
+                for chunk in self.iter_html(os.path.dirname(filename)):
+                    f.write(chunk)
         if clear:
             self.clear()
-    
-    def show(self, clear=True):
-        data = base64.b64encode(self.html.encode('utf-8')).decode('utf-8')
-        url = f'data:text/html;base64,{data}'
-        display(IFrame(url, width=self._width, height=self._height))
+
+    def show(self, clear=True, tempdir=None, update=False):
+        """
+        Display the page in an IFrame
+            - by default the page is embedded as a base64 data URL
+            - with tempdir, the page is saved to a temporary file in that directory and the IFrame
+              points at it instead; it must be a directory the notebook server can reach (e.g. '.'),
+              and the file is kept until python exits
+            - with update, a page still on display from an earlier show(clear=False, update=True)
+              is patched in place with only the changed expressions
+        """
+        from IPython.display import HTML, DisplayHandle, IFrame, display
+        if update and self._display is not None:
+            frame,handle,target = self._display
+            message = self.patch(snippet=False)
+            handle.update(HTML(_post_fmt%{'frame':json.dumps(frame), 'message':message, 'target':target}))
+        else:
+            if tempdir is None:
+                # a data URL has no directory to load assets from, and an opaque origin to post patches to
+                html = ''.join(self.iter_html(inline=True, patchable=update))
+                data = base64.b64encode(html.encode('utf-8')).decode('utf-8')
+                url,target = f'data:text/html;base64,{data}','"*"'
+            else:
+                import tempfile
+                fd,path = tempfile.mkstemp(suffix='.htm', prefix='desmospy-', dir=tempdir)
+                os.close(fd)
+                _temp_pages.append(path)
+                with _writing(path) as f:
+                    for chunk in self.iter_html(os.path.dirname(path), patchable=update):
+                        f.write(chunk)
+                url,target = os.path.relpath(path),'window.location.origin'
+            if update:
+                frame = 'desmospy-%x'%id(self)
+                display(HTML(_frame_fmt%{'frame':frame, 'url':url, 'width':self._width, 'height':self._height}))
+                handle = DisplayHandle()
+                handle.display(HTML(''))
+                self._display = (frame, handle, target)
+            else:
+                display(IFrame(url, width=self._width, height=self._height))
         if clear:
             self.clear()
 
+class Template(object):
+    """
+    A rendered page with holes for the values of some variables (see Calculator.template())
+        - values can be latex strings, numbers, points (2-tuples) or lists, formatted as list() and point() would
+        - holes without a value keep the value the page was rendered with
+    """
+    def __init__(self, parts, defaults, precision=15):
+        self._parts = parts # page text, alternating with the names of the holes
+        self._defaults = defaults
+        self._precision = precision
+
+    @property
+    def names(self):
+        return tuple(self._defaults)
+
+    def _latex(self, value):
+        if isinstance(value, str):
+            return json.dumps(value)[1:-1]
+        if '__iter__' not in dir(value):
+            # as assigned to a variable, e.g. calc.a = 0.3
+            return json.dumps(render_latex(sympy.sympify(value)))[1:-1]
+        if isinstance(value, tuple) and len(value) == 2:
+            numbers = _format_numbers(value, self._precision)
+            numbers = numbers and f'({numbers})'
+        else:
+            numbers = _format_numbers(list(value), self._precision)
+            numbers = numbers and f'[{numbers}]'
+        if numbers is None:
+            raise ValueError(f'can\'t format {value!r} as desmos latex; pass a latex string instead')
+        return numbers
+
+    def render(self, **values):
+        """ Fill the holes with the given values, returning the page. """
+        unknown = set(values) - set(self._defaults)
+        if unknown:
+            raise ValueError(f'no hole for {", ".join(sorted(unknown))}')
+        latex = dict(self._defaults, **dict((name, _script_safe(self._latex(value))) for name,value in values.items()))
+        parts = list(self._parts)
+        parts[1::2] = [ latex[name] for name in parts[1::2] ]
+        return ''.join(parts)
+
+    def save(self, filename, **values):
+        """ Write the page filled with the given values to filename, gzipped if it ends with '.gz' (see Calculator.save()). """
+        with _writing(filename, str(filename).endswith('.gz')) as f:
+            f.write(self.render(**values))
+        return filename
+
+    def render_many(self, params, out_dir, workers=None, name='page-{index:04d}.htm'):
+        """
+        Write one page per dict of values in params to out_dir, in a pool of worker threads if workers is given
+            - name is formatted with the page's index and values
+            - returns the paths written, in order
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        jobs = [ (os.path.join(out_dir, name.format(index=index, **values)), values) for index,values in enumerate(params) ]
+        if not workers:
+            return [ self.save(path, **values) for path,values in jobs ]
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda job: self.save(job[0], **job[1]), jobs))
+
 class Folder(ExpressionCollection):
     def __init__(self, parent, name):
         self._root = parent
@@ -281,6 +1850,10 @@ class Folder(ExpressionCollection):
     def activate(self):
         self._parent.activateFolder(self)
 
+    @property
+    def expression_state(self):
+        return {'type': 'folder', 'title': self._name, 'collapsed': True}
+
     @property
     def html(self):
         # Reserve and save ids of children
@@ -294,32 +1867,81 @@ class Folder(ExpressionCollection):
         return self._child_ids
 
 class Expression(object):
+    # state: desmos properties set through config(), if any
+    # _rendered, _html: memoized (key,latex) and (latex,html) of the last render, if any
+    __slots__ = ('state', '_rendered', '_html')
+
     def config(self, **kwargs):
         try:
             self.state.update(kwargs)
-        except:
+        except AttributeError:
             self.state = kwargs
-        
+        self._html = None
+
+    @property
+    def key(self):
+        """ Immutable value that determines the rendered latex. """
+        return self.expr
+
+    def __str__(self):
+        key = self.key
+        rendered = getattr(self, '_rendered', None)
+        if rendered is None or rendered[0] != key:
+            rendered = self._rendered = (key, self.render())
+        return rendered[1]
+
+    def latex(self):
+        """ The latex to emit: str(self), unless overridden in the page being rendered. """
+        if _overrides:
+            latex = _overrides.get(self)
+            if latex is not None:
+                return latex
+        return str(self)
+
+    @property
+    def expression_state(self):
+        """ The desmos state of this expression (without its id). """
+        expr = {'type': 'expression', 'latex': self.latex()}
+        expr.update(getattr(self, 'state', ()))
+        return expr
+
     @property
     def html(self):
-        expr = {'latex': str(self)}
-        if 'state' in dir(self):
-            expr.update(self.state)
-        return f'calculator.setExpression({json.dumps(expr)});'
+        latex = self.latex()
+        html = getattr(self, '_html', None)
+        if html is None or html[0] is not latex:
+            expr = {'latex': latex}
+            expr.update(getattr(self, 'state', ()))
+            html = self._html = (latex, f'calculator.setExpression({_timed("json", json.dumps, expr)});')
+        return html[1]
 
 class Statement(Expression):
+    # _owner: the expression that assigned this statement, which receives its config()
+    __slots__ = ('expr', '_owner')
+
     def __init__(self, value=None):
         if isinstance(value, str):
             value = sympy.Symbol(value)
         self.expr = value
 
+    @classmethod
+    def _wrap(cls, expr):
+        """ Cheap construction around an existing sympy expression. """
+        result = object.__new__(cls)
+        result.expr = expr
+        return result
+
     @classmethod
     def from_value(cls, val):
         if isinstance(val, Statement):
             return val
-        result = Statement()
-        result.expr = val
-        return result
+        return Statement._wrap(val)
+
+    def config(self, **kwargs):
+        owner = getattr(self, '_owner', None)
+        if owner is not None:
+            return owner.config(**kwargs)
+        Expression.config(self, **kwargs)
     
     @staticmethod
     def ref(val):
@@ -346,59 +1968,37 @@ class Statement(Expression):
         return Equality(Statement.ref(other), self.expr)
 
     def __neg__(self):
-        result = Statement()
-        result.expr = -self.expr
-        return result
+        return Statement._wrap(-self.expr)
 
     def __add__(self, other):
-        result = Statement()
-        result.expr = self.expr + Statement.ref(other)
-        return result
+        return Statement._wrap(self.expr + Statement.ref(other))
 
     def __radd__(self, other):
-        result = Statement()
-        result.expr = Statement.ref(other) + self.expr
-        return result
+        return Statement._wrap(Statement.ref(other) + self.expr)
 
     def __sub__(self, other):
-        result = Statement()
-        result.expr = self.expr - Statement.ref(other)
-        return result
+        return Statement._wrap(self.expr - Statement.ref(other))
 
     def __rsub__(self, other):
-        result = Statement()
-        result.expr = Statement.ref(other) - self.expr
-        return result
+        return Statement._wrap(Statement.ref(other) - self.expr)
 
     def __mul__(self, other):
-        result = Statement()
-        result.expr = self.expr * Statement.ref(other)
-        return result
+        return Statement._wrap(self.expr * Statement.ref(other))
 
     def __rmul__(self, other):
-        result = Statement()
-        result.expr = Statement.ref(other) * self.expr
-        return result
+        return Statement._wrap(Statement.ref(other) * self.expr)
 
     def __truediv__(self, other):
-        result = Statement()
-        result.expr = self.expr / Statement.ref(other)
-        return result
+        return Statement._wrap(self.expr / Statement.ref(other))
 
     def __rtruediv__(self, other):
-        result = Statement()
-        result.expr = Statement.ref(other) / self.expr
-        return result
+        return Statement._wrap(Statement.ref(other) / self.expr)
 
     def __pow__(self, other):
-        result = Statement()
-        result.expr = self.expr ** Statement.ref(other)
-        return result
+        return Statement._wrap(self.expr ** Statement.ref(other))
 
     def __rpow__(self, other):
-        result = Statement()
-        result.expr = Statement.ref(other) ** self.expr
-        return result
+        return Statement._wrap(Statement.ref(other) ** self.expr)
 
     def __and__(self, other):
         return (self >= 0) & other
@@ -415,34 +2015,40 @@ class Statement(Expression):
     def __rxor__(self, other):
         return other ^ (self >= 0)
 
-    def __str__(self):
+    def render(self):
         return str(self.expr)
 
 class StatementAttribute(Statement):
+    __slots__ = ('_statement', '_attr')
+
     def __init__(self, statement, attr):
         self._statement = statement
         self._attr = attr
+        self.expr = self.AttrSymbol(f'{str(statement)}.{attr}')
+
+    @_lazy_class
+    def AttrSymbol():
         class AttrSymbol(sympy.Symbol):
-            def _latex(self, printer):
-                return f'{str(statement)}.{attr}'
-        self.expr = AttrSymbol(f'{str(statement)}.{attr}')
+            """ Symbol printed verbatim, e.g. 'm.length' (see DesmosPrinter) """
+        AttrSymbol.__qualname__ = 'StatementAttribute.AttrSymbol'
+        return AttrSymbol
 
 
 class IndexedBase(Statement):
+    __slots__ = ()
+
     def __init__(self, base):
         self.expr = sympy.IndexedBase(str(base))
 
-    class Indexed(sympy.Indexed):
-        def _latex(self, printer):
-            tex_base = printer._print(self.base)
-            tex = '{'+tex_base+'}'+'[%s]' % ','.join(
-                (printer._print(i+1) for i in self.indices))
-            return tex
-            
+    @_lazy_class
+    def Indexed():
+        class Indexed(sympy.Indexed):
+            """ desmos list element, indexed from 0 in python and printed from 1 (see DesmosPrinter) """
+        Indexed.__qualname__ = 'IndexedBase.Indexed'
+        return Indexed
+
     def __getitem__(self, index):
-        val = Statement()
-        val.expr = self.Indexed(self.expr, index)
-        return val
+        return Statement._wrap(self.Indexed(self.expr, index))
         
     @property
     def length(self):
@@ -452,9 +2058,46 @@ class IndexedBaseValue(Statement):
     """
     Used to detect when an assignment should create an IndexedBase class.
     """
-    pass
+    __slots__ = ()
+
+class ShardedList(object):
+    """
+    A list longer than desmos accepts, defined as consecutive shards (see ExpressionCollection.ingest())
+        - indexing picks an element across the shards, e.g. h[i-1], and length is the total number of elements
+        - sum() over all of the elements adds up one total() per shard
+    """
+    __slots__ = ('shards', 'starts', 'length')
+
+    def __init__(self, shards, starts, length):
+        self.shards = shards # the IndexedBase of each shard
+        self.starts = starts # the index of the first element of each shard
+        self.length = length
+
+    @staticmethod
+    def shard_name(name, number):
+        """ e.g. m_{s2} for the second shard of m, or x_{1s2} for x_1 """
+        head,_,subscript = name.partition('_')
+        return f'{head}_{{{subscript.strip("{}")}s{number}}}'
+
+    @_lazy_class
+    def Element():
+        class Element(sympy.Function):
+            """ Element(index, shards, starts, length): the element at index, printed as a desmos piecewise over the shards (see DesmosPrinter) """
+        Element.__qualname__ = 'ShardedList.Element'
+        return Element
+
+    def __getitem__(self, index):
+        index = Statement.ref(index)
+        if isinstance(index, int) or getattr(index, 'is_Integer', False):
+            index = int(index) + (self.length if index < 0 else 0)
+            shard = bisect.bisect_right(self.starts, index) - 1
+            return self.shards[shard][index - self.starts[shard]]
+        return Statement._wrap(self.Element(index, sympy.Tuple(*(shard.expr for shard in self.shards)),
+                                            sympy.Tuple(*self.starts), self.length))
 
 class Function(Statement):
+    __slots__ = ('_fn',)
+
     def __init__(self, name):
         if any(symbol in name for symbol in '<>'):
             raise ValueError(f'invalid function name "{name}"')
@@ -475,20 +2118,33 @@ class NativeFunction(Function):
     This allows sympy to do simplification where possible,
     **assuming** that Desmos will be able to interpret the result.
     """
+    __slots__ = ()
+
     def __init__(self, fn):
         self.expr = self._fn = fn
 
 class Inequality(Expression):
+    __slots__ = ('lhs', 'rhs')
+
     def __init__(self, lhs, rhs):
         if isinstance(lhs, Statement):
-            lhs.config = self.config
+            lhs._owner = self
             lhs = lhs.expr
         if isinstance(rhs, Statement):
             rhs = rhs.expr
         self.lhs,self.rhs = (lhs, rhs)
         
-    def __str__(self):
-        return sympy.latex(self.op(self.lhs, self.rhs))
+    @property
+    def key(self):
+        return (self.op, self.lhs, self.rhs)
+
+    @property
+    def form(self):
+        """ The sympy expression that is rendered. """
+        return self.op(self.lhs, self.rhs)
+
+    def render(self, form=None):
+        return render_latex(self.form if form is None else form)
 
     def __and__(self, other):
         return Intersect().add(self).add(other)
@@ -512,10 +2168,12 @@ class Inequality(Expression):
         return XOR().add(self)
 
 class LessThan(Inequality):
-    def __init__(self, lhs, rhs):
-        super().__init__(lhs, rhs)
-        self.op = sympy.Lt
-        self.strict = True
+    __slots__ = ()
+    strict = True
+
+    @property
+    def op(self):
+        return sympy.Lt
 
     def __invert__(self):
         return GreaterEqual(self.lhs, self.rhs)
@@ -526,10 +2184,12 @@ class LessThan(Inequality):
         return self.rhs - self.lhs
 
 class LessEqual(Inequality):
-    def __init__(self, lhs, rhs):
-        super().__init__(lhs, rhs)
-        self.op = sympy.Le
-        self.strict = False
+    __slots__ = ()
+    strict = False
+
+    @property
+    def op(self):
+        return sympy.Le
 
     def __invert__(self):
         return GreaterThan(self.lhs, self.rhs)
@@ -540,10 +2200,12 @@ class LessEqual(Inequality):
         return self.rhs - self.lhs
 
 class GreaterThan(Inequality):
-    def __init__(self, lhs, rhs):
-        super().__init__(lhs, rhs)
-        self.op = sympy.Gt
-        self.strict = True
+    __slots__ = ()
+    strict = True
+
+    @property
+    def op(self):
+        return sympy.Gt
 
     def __invert__(self):
         return LessEqual(self.lhs, self.rhs)
@@ -554,10 +2216,12 @@ class GreaterThan(Inequality):
         return self.lhs - self.rhs
 
 class GreaterEqual(Inequality):
-    def __init__(self, lhs, rhs):
-        super().__init__(lhs, rhs)
-        self.op = sympy.Ge
-        self.strict = False
+    __slots__ = ()
+    strict = False
+
+    @property
+    def op(self):
+        return sympy.Ge
 
     def __invert__(self):
         return LessThan(self.lhs, self.rhs)
@@ -568,20 +2232,50 @@ class GreaterEqual(Inequality):
         return self.lhs - self.rhs
 
 class Equality(Expression):
+    # precompute: set() override of the calculator's precompute setting, if any
+    __slots__ = ('expr', 'precompute')
+
     def __init__(self, lhs, rhs):
         if isinstance(lhs, Statement):
-            lhs.config = self.config
+            lhs._owner = self
             lhs = lhs.expr
         if isinstance(rhs, Statement):
             rhs = rhs.expr
         self.expr = sympy.Eq(lhs, rhs)
 
-    def __str__(self):
-        return sympy.latex(self.expr)
+    @property
+    def form(self):
+        return self.expr
+
+    def render(self, form=None):
+        return render_latex(self.expr if form is None else form)
+
+class Table(Expression):
+    __slots__ = ('columns',)
+
+    def __init__(self, names, values):
+        self.columns = [ {'latex': render_latex(sympy.Symbol(name)), 'values': column}
+                         for name,column in zip(names, values) ]
+
+    @property
+    def expression_state(self):
+        # the columns decimated for the page being rendered, if any
+        columns = _overrides.get(self, self.columns) if _overrides else self.columns
+        expr = {'type': 'table', 'columns': columns}
+        expr.update(getattr(self, 'state', ()))
+        return expr
+
+    @property
+    def html(self):
+        return f'calculator.setExpression({json.dumps(self.expression_state, separators=(",",":"))});'
 
 class Boolean(Expression):
+    __slots__ = ('components', 'strict', 'simplify', 'budget')
+
     def __init__(self):
         self.components = []
+        self.simplify = 'full'
+        self.budget = None
     def __and__(self, other):
         return Intersect().add(self).add(other)
     def __or__(self, other):
@@ -598,13 +2292,20 @@ class Boolean(Expression):
         else:
             self.components.append(component.lump)
         return self
-    def __str__(self):
+    @property
+    def key(self):
+        return (self.__class__, self.strict, tuple(self.components), self.simplify, self.budget)
+
+    @property
+    def form(self):
         op = sympy.Gt if self.strict else sympy.Ge
-        result = op(self.lump, 0)
-        result = sympy.simplify(result)
-        return sympy.latex(result)
+        return op(self.lump, 0)
+
+    def render(self, form=None):
+        return render_latex(self.form if form is None else form, self.simplify, self.budget)
 
 class Intersect(Boolean):
+    __slots__ = ()
     def __and__(self, other):
         return self.add(other)
     @property
@@ -612,6 +2313,7 @@ class Intersect(Boolean):
         return sympy.Min(*self.components)
 
 class Union(Boolean):
+    __slots__ = ()
     def __or__(self, other):
         return self.add(other)
     @property
@@ -619,38 +2321,126 @@ class Union(Boolean):
         return sympy.Max(*self.components)
 
 class XOR(Boolean):
+    __slots__ = ()
     def __xor__(self, other):
         return self.add(other)
     @property
     def lump(self):
         return -sympy.Mul(*self.components)
 
-html_fmt = lambda url,exp,opt,tree,config: """
+_head_fmt = """
 <body style="background-color:#2A2A2A;" marginwidth="0px" marginheight="0px">
 <style>
 .dcg-smart-textarea-container {
     min-height: 24;
 }
 </style>
-<script src="%(url)s"></script>
+%(library)s
 <div id="calculator"></div>
 <script>
   var elt = document.getElementById("calculator");
   var calculator = Desmos.GraphingCalculator(elt, options=%(options)s);
-  %(expressions)s
+"""
+
+# applies patch(): run as a snippet, or posted by the page showing this one, with the calculator's token
+_patch_fmt = """  function desmospyPatch(patch) {
+    calculator.removeExpressions(patch.remove.map(function(id) { return {id: id}; }));
+    if (patch.set.some(function(e) { return e.type == 'folder' || e.folderId; })) {
+      // folder members must follow their folder, so merge into the full state
+      var state = calculator.getState();
+      var list = state.expressions.list;
+      for (var e of patch.set) {
+        var i = list.findIndex(function(old) { return old.id == e.id; });
+        if (i < 0 && e.folderId) {
+          i = list.findIndex(function(old) { return old.id == e.folderId; });
+          while (i+1 < list.length && list[i+1].folderId == e.folderId) i++;
+          list.splice(i+1, 0, e);
+        } else if (i < 0) {
+          list.push(e);
+        } else {
+          list[i] = e;
+        }
+      }
+      calculator.setState(state);
+    } else {
+      calculator.setExpressions(patch.set);
+    }
+    var v = patch.graph.viewport;
+    if (v) calculator.setMathBounds({left: v.xmin, right: v.xmax, bottom: v.ymin, top: v.ymax});
+  }
+  window.addEventListener('message', function(event) {
+    if (event.source === window.parent && event.data && event.data.token === %(token)s && event.data.desmospy) {
+      desmospyPatch(event.data.desmospy);
+    }
+  });
+"""
+
+_expressions_tail_fmt = """
 
   state = calculator.getState();
-  expr = state.expressions.list;
+  expr = {};
+  ids = %(ids)s;
+  for (i in ids) {
+    state.expressions.list[i].id = ids[i];
+    expr[ids[i]] = state.expressions.list[i];
+  }
   folders = %(folders)s;
   for (folder in folders) {
     expr[folder].type = 'folder';
     expr[folder].title = expr[folder].text;
     expr[folder].collapsed = true;
     for (member of folders[folder]) {
-      expr[member].folderId = expr[folder].id;
+      expr[member].folderId = folder;
     }
   }
   calculator.setState(state);
   %(config)s
 </script>
-"""%{'url':url, 'expressions':exp, 'options':opt, 'folders':tree, 'config':config}
+"""
+
+_state_tail_fmt = """  var blank = calculator.getState();
+  Object.assign(blank.graph, state.graph);
+  blank.expressions = state.expressions;
+  calculator.setState(blank);
+</script>
+"""
+
+_compact_tail_fmt = """
+function desmospyLoad(packed) {
+var blank = calculator.getState();
+Object.assign(blank.graph, packed.graph);
+blank.expressions = {list: packed.list.map(function(e) {
+if (!e.type) { e.type = 'expression'; e.latex = packed.latex[e.latex]; }
+return e;
+})};
+calculator.setState(blank);
+}
+</script>
+"""
+
+_inflate_fmt = """var bytes = Uint8Array.from(atob("%(data)s"), function(c) { return c.charCodeAt(0); });
+new Response(new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'))).json().then(desmospyLoad);"""
+
+def _minify(html):
+    """ Strip the indentation, blank lines and comment lines of a template. """
+    lines = (line.strip() for line in html.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+_library_fmt = '<script src="%s"></script>'
+
+@functools.lru_cache(maxsize=4)
+def _read_asset(path, mtime):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+_frame_fmt = '<iframe id="%(frame)s" src="%(url)s" width="%(width)s" height="%(height)s" frameborder="0" allowfullscreen></iframe>'
+
+_post_fmt = '<script>document.getElementById(%(frame)s).contentWindow.postMessage(%(message)s, %(target)s);</script>'
+
+# ids (of the expressions in order) is optional, after the original arguments; without it folders are keyed by position
+html_fmt = lambda url,exp,opt,tree,config,ids=None: (_head_fmt%{'library':_library_fmt%url, 'options':opt} + '  ' + exp
+    + _expressions_tail_fmt%{'ids':ids or 'state.expressions.list.map(function(e, i) { return String(i); })',
+                             'folders':tree, 'config':config})
+
+state_fmt = lambda url,state,opt: (_head_fmt%{'library':_library_fmt%url, 'options':opt} + '  var state = %s;\n'%state
+    + _state_tail_fmt)
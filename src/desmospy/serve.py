@@ -0,0 +1,443 @@
+"""
+Render service: a local HTTP server turning declarative JSON graph specs into desmos pages
+
+    desmospy serve [--host 127.0.0.1] [--port 8000] [--workers N] [--timeout SECONDS] [--max-body BYTES] [--assets DIR]
+
+    POST /render   a JSON spec (see build()), answered with the page as text/html
+    GET  /metrics  request counts, throughput and latencies as JSON
+
+Each spec is built on a fresh Calculator in one of a pool of worker processes, which import sympy and
+render a warm-up graph when they start, and share rendered latex between their requests (see render_cache()).
+"""
+import argparse
+import ast
+import collections
+import json
+import math
+import numbers
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import desmospy
+
+_integer = lambda value: isinstance(value, int) and not isinstance(value, bool)
+
+# the Calculator arguments a spec may set, with a check of their values: others reach the filesystem or the network,
+# spawn processes or run unbounded computations (e.g. precompute), and are the server's to choose
+_spec_options = {
+    'size': lambda value: isinstance(value, list) and len(value) == 2 and all(_integer(n) and 0 < n <= 4096 for n in value),
+    'mode': lambda value: value in ('expressions', 'state', 'compact'),
+    'precision': lambda value: value == 'repr' or (_integer(value) and 1 <= value <= 17),
+    'simplify': lambda value: value in desmospy._policies,
+}
+# Desmos API options, of plain values
+_spec_options.update((name, lambda value: isinstance(value, (bool, int, float, str))) for name in (
+    'keypad', 'graphpaper', 'expressions', 'settingsMenu', 'zoomButtons', 'expressionsTopbar', 'pointsOfInterest', 'trace',
+    'border', 'lockViewport', 'expressionsCollapsed', 'showGrid', 'showXAxis', 'showYAxis', 'xAxisNumbers', 'yAxisNumbers',
+    'polarNumbers', 'xAxisStep', 'yAxisStep', 'xAxisMinorSubdivisions', 'yAxisMinorSubdivisions', 'xAxisArrowMode',
+    'yAxisArrowMode', 'xAxisLabel', 'yAxisLabel', 'degreeMode', 'polarMode', 'projectorMode', 'invertedColors',
+    'fontSize', 'language', 'backgroundColor', 'textColor'))
+
+# names a spec may define or use: a letter or word, with an optional subscript, as desmos reads them (e.g. a, t_c, f_scarlet)
+_name = re.compile(r'[A-Za-z][A-Za-z0-9]*(_[A-Za-z0-9]+)?\Z')
+
+def _check_name(name):
+    if not isinstance(name, str) or not _name.match(name):
+        raise ValueError(f'{name!r} is not a desmos name')
+    return name
+
+# a definition or equation: the first '=' that isn't part of a comparison
+_assignment = re.compile(r'(?<![<>=!])=(?!=)')
+
+# numbers a spec may write or compute, and numeric exponents, stay within these: 9**9**9 would never finish
+_max_digits = 100
+_max_exponent = 1000
+# lists and ranges of numbers stay within what desmos accepts
+_max_list = desmospy._LIST_CAP
+
+def _power(a, b):
+    if isinstance(b, numbers.Number) and not abs(b) <= _max_exponent:
+        raise ValueError(f'exponent {b} is too large')
+    if isinstance(a, numbers.Number) and isinstance(b, numbers.Number) and abs(a) > 1 and abs(b)*math.log10(abs(a)) > _max_digits:
+        raise ValueError(f'{a}**{b} is too large')
+    return a ** b
+
+_operators = {
+    ast.Add: lambda a,b: a + b,
+    ast.Sub: lambda a,b: a - b,
+    ast.Mult: lambda a,b: a * b,
+    ast.Div: lambda a,b: a / b,
+    ast.Pow: _power,
+    ast.BitAnd: lambda a,b: a & b,
+    ast.BitOr: lambda a,b: a | b,
+    ast.BitXor: lambda a,b: a ^ b,
+    ast.USub: lambda a: -a,
+    ast.UAdd: lambda a: +a,
+    ast.Lt: lambda a,b: a < b,
+    ast.LtE: lambda a,b: a <= b,
+    ast.Gt: lambda a,b: a > b,
+    ast.GtE: lambda a,b: a >= b,
+    ast.Eq: lambda a,b: a == b,
+}
+
+def _range(collection, *args):
+    if len(args) in (1, 2) and all(isinstance(arg, numbers.Number) for arg in args):
+        if args[-1] - (args[0] if len(args) == 2 else 0) > _max_list:
+            raise ValueError(f'ranges are limited to {_max_list} elements')
+    return collection.range(*args)
+
+def _evaluate(node, collection, params):
+    """
+    Evaluate a parsed python expression with the calculator's names, as python code using desmospy would
+        - only numbers, names, arithmetic, comparisons, &|^, calls of desmos functions, list[index],
+          points (a, b) and lists [a, b, ...] are accepted: nothing else of python is reachable
+        - numbers are limited to _max_digits digits, numeric exponents to _max_exponent, and lists and ranges to _max_list elements
+    """
+    evaluate = lambda node: _evaluate(node, collection, params)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        if not abs(node.value) < 10**_max_digits:
+            raise ValueError(f'number {node.value} is too large')
+        return node.value
+    if isinstance(node, ast.Name):
+        if node.id in params:
+            return params[node.id]
+        value = collection.__getattr__(_check_name(node.id))
+        if not isinstance(value, (desmospy.Statement, desmospy.ShardedList, desmospy.sympy.Basic)):
+            raise ValueError(f'{node.id} is not a desmos value')
+        return value
+    if isinstance(node, ast.BinOp) and type(node.op) in _operators:
+        return _operators[type(node.op)](evaluate(node.left), evaluate(node.right))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _operators:
+        return _operators[type(node.op)](evaluate(node.operand))
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in _operators:
+        return _operators[type(node.ops[0])](desmospy.Statement.from_value(evaluate(node.left)), evaluate(node.comparators[0]))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        args = [ evaluate(arg) for arg in node.args ]
+        if node.func.id == 'abs':
+            return collection.abs(*args)
+        if node.func.id == 'range':
+            return _range(collection, *args)
+        fn = collection.__getattr__(_check_name(node.func.id))
+        if not isinstance(fn, desmospy.Function):
+            raise ValueError(f'{node.func.id} is not a desmos function')
+        return fn(*args)
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name):
+        index = node.slice.value if sys.version_info < (3, 9) else node.slice
+        return evaluate(node.value)[evaluate(index)]
+    if isinstance(node, ast.Tuple) and len(node.elts) == 2:
+        return collection.point(*map(evaluate, node.elts))
+    if isinstance(node, ast.List):
+        if len(node.elts) > _max_list:
+            raise ValueError(f'lists are limited to {_max_list} elements')
+        return [ evaluate(elt) for elt in node.elts ]
+    raise ValueError(f'unsupported syntax: {ast.dump(node)}')
+
+def _parse(text):
+    try:
+        return ast.parse(text.strip(), mode='eval').body
+    except SyntaxError as e:
+        raise ValueError(f'invalid expression "{text}": {e.msg}')
+
+def _add(collection, item):
+    """ Add one item of a spec's expressions to collection (the calculator or a folder). """
+    if isinstance(item, str):
+        item = {'expr': item}
+    if not isinstance(item, dict):
+        raise ValueError(f'expected an expression string or object, got {item!r}')
+    if 'folder' in item:
+        folder = collection.folder(str(item['folder']))
+        for member in item.get('expressions', []):
+            _add(folder, member)
+        return
+    config = item.get('config', {})
+    if 'name' in item: # plain data, e.g. {"name": "m", "value": [1, 2, 3]}
+        _check_name(item['name'])
+        value = item['value']
+        if not (isinstance(value, (int, float)) or isinstance(value, list) and len(value) <= _max_list
+                and all(isinstance(n, (int, float)) for n in value)) or isinstance(value, bool):
+            raise ValueError(f'the value of {item["name"]} is not a number or a list of at most {_max_list} numbers')
+        collection.__setattr__(item['name'], value)
+        collection.__getattr__(item['name']).config(**config)
+        return
+
+    parts = _assignment.split(item['expr'], maxsplit=1)
+    rhs = _parse(parts[-1])
+    lhs = _parse(parts[0]) if len(parts) == 2 else None
+    if isinstance(lhs, ast.Name):
+        collection.__setattr__(_check_name(lhs.id), _evaluate(rhs, collection, {}))
+        collection.__getattr__(lhs.id).config(**config)
+    elif isinstance(lhs, ast.Call) and isinstance(lhs.func, ast.Name) and all(isinstance(arg, ast.Name) for arg in lhs.args):
+        # a function definition, as in ExpressionCollection.function()
+        args = [ _check_name(arg.id) for arg in lhs.args ]
+        _check_name(lhs.func.id)
+        with collection._root._defining(args):
+            body = _evaluate(rhs, collection, dict((arg, desmospy.Statement(arg)) for arg in args))
+        if isinstance(body, (desmospy.Boolean, desmospy.Inequality)):
+            body = body.lump
+        fn = desmospy.Function(lhs.func.id)
+        collection._root._cache[lhs.func.id] = fn
+        expr = collection.set(desmospy.Equality(fn(*args), desmospy.Statement.ref(body)), **config)
+        fn._owner = expr
+    else:
+        expr = _evaluate(rhs, collection, {})
+        if lhs is not None:
+            expr = desmospy.Statement.from_value(_evaluate(lhs, collection, {})) == expr
+        collection.set(expr, simplify=item.get('simplify'), **config)
+
+def build(spec, **options):
+    """
+    Build the Calculator described by a JSON spec, e.g.
+        {"options": {"size": [800, 600], "showGrid": false, "mode": "state"},
+         "bounds": {"left": -10, "right": 10, "bottom": -10, "top": 10},
+         "expressions": ["a = 0.3",
+                         {"expr": "y < a*x", "config": {"color": "#BE0119"}},
+                         {"expr": "x**2/49 + y**2/16 <= 1", "simplify": "fast"},
+                         "f(x, y) = sin(x)*y",
+                         {"folder": "data", "expressions": [{"name": "m", "value": [1, 2, 3]}, "p = (1, 2)"]}]}
+        - expressions are python expressions over the calculator's names, as written with desmospy
+          (so ** is a power and ^ a xor of regions), defining a name, a function, or added with set()
+        - options are Calculator arguments: a spec may only set those of _spec_options,
+          and options passed here (the server's) take precedence
+        - names are letters or words with an optional subscript, bounds are numbers
+    """
+    if not isinstance(spec, dict):
+        raise ValueError('a spec is a JSON object')
+    kwargs = dict(spec.get('options', {}))
+    for name,value in kwargs.items():
+        if name not in _spec_options:
+            raise ValueError(f'option {name} can\'t be set by a spec')
+        if not _spec_options[name](value):
+            raise ValueError(f'invalid value of option {name}: {value!r}')
+    kwargs.update(options)
+    calc = desmospy.Calculator(**kwargs)
+    if 'bounds' in spec:
+        bounds = dict(spec['bounds'])
+        if not (set(bounds) <= {'left', 'right', 'bottom', 'top'} and
+                all(isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value) for value in bounds.values())):
+            raise ValueError('bounds are numbers, among left, right, bottom and top')
+        calc.bounds(**bounds)
+    for item in spec.get('expressions', []):
+        _add(calc, item)
+    return calc
+
+def render(spec, **options):
+    """ Build and render a spec, returning (html, build seconds, render seconds). """
+    start = time.perf_counter()
+    calc = build(spec, **options)
+    built = time.perf_counter()
+    html = calc.html
+    return html, built - start, time.perf_counter() - built
+
+def _render_job(spec, timeout, options):
+    """
+    render() in a worker, stopped after timeout seconds with TimeoutError
+        - workers run jobs on their main thread, where SIGALRM interrupts them (on POSIX systems): the worker survives for the next jobs
+    """
+    if not timeout or not hasattr(signal, 'setitimer'):
+        return render(spec, **options)
+    def expire(signum, frame):
+        raise TimeoutError(f'render exceeded {timeout} seconds')
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return render(spec, **options)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def _warm(options):
+    """ Worker initializer: import and exercise sympy and the printer before the first request. """
+    desmospy.render_cache()
+    render({'expressions': ['a = 0.3', 'y < a*x**2 + sin(x)', '(x**2 + y**2 < 4) ^ (x < 1)']}, **options)
+
+class Metrics(object):
+    """
+    Counters of a running server, updated from its request threads
+        - latencies of the last window requests give the percentiles
+    """
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = self.errors = self.in_flight = self.bytes = 0
+        self.build_s = self.render_s = 0.0
+        self.latencies = collections.deque(maxlen=window)
+
+    def as_dict(self):
+        with self.lock:
+            uptime = time.time() - self.started
+            latencies = sorted(self.latencies)
+            percentile = lambda p: latencies[min(len(latencies)-1, int(p*len(latencies)))] if latencies else None
+            done = self.requests - self.errors
+            return {
+                'uptime_s': uptime,
+                'requests': self.requests,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'requests_per_s': self.requests / uptime if uptime else 0.0,
+                'bytes': self.bytes,
+                'latency_s': {'mean': sum(latencies)/len(latencies) if latencies else None,
+                              'p50': percentile(0.5), 'p95': percentile(0.95), 'max': latencies[-1] if latencies else None},
+                'build_s_mean': self.build_s / done if done else None,
+                'render_s_mean': self.render_s / done if done else None,
+            }
+
+class Server(ThreadingHTTPServer):
+    """ HTTP server handing specs to a pool of warm worker processes (see the module docstring) """
+    daemon_threads = True
+
+    quiet = False
+
+    # seconds a worker may overrun the timeout before the server gives up on it (e.g. stuck in C code, out of reach of SIGALRM)
+    kill_grace = 5.0
+
+    def __init__(self, address, workers=None, timeout=30.0, options=None, max_body=1<<20):
+        super().__init__(address, Handler)
+        self.workers = workers or os.cpu_count() or 1
+        self.render_timeout = timeout
+        self.max_body = max_body
+        self.options = options or {}
+        self.metrics = Metrics()
+        self.pool_lock = threading.Lock()
+        self.pool = self._start_pool()
+
+    def _start_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_warm, initargs=(self.options,))
+
+    def _replace_pool(self, pool, kill=False):
+        with self.pool_lock:
+            if self.pool is pool:
+                self.pool = self._start_pool()
+                processes = list((pool._processes or {}).values())
+                pool.shutdown(wait=False)
+                if kill:
+                    for process in processes:
+                        process.terminate()
+
+    def render(self, spec):
+        """
+        Render spec in the pool, raising TimeoutError if it takes longer than render_timeout
+            - the worker stops a job that runs too long itself (see _render_job()); a job still queued after
+              that long is dropped, and only a job its worker fails to stop gets the pool killed
+        """
+        pool = self.pool
+        future = pool.submit(_render_job, spec, self.render_timeout, self.options)
+        if not self.render_timeout:
+            return self._result(pool, future)
+        start = time.perf_counter()
+        # the pool marks a job running as it hands it to the workers, when it may still wait for one job to finish
+        limit = 2*self.render_timeout + self.kill_grace
+        running = None
+        while True:
+            if wait([future], 0.5).done:
+                return self._result(pool, future) # the result, or the TimeoutError of a job its worker stopped
+            if running is None and future.running():
+                running = time.perf_counter()
+            if running is None and time.perf_counter() - start > self.render_timeout and future.cancel():
+                raise TimeoutError()
+            if running is not None and time.perf_counter() - running > limit:
+                # the worker didn't stop it: kill the pool (failing the renders it shares with this one) and start afresh
+                self._replace_pool(pool, kill=True)
+                raise TimeoutError()
+
+    def _result(self, pool, future):
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for memory): replace the pool for the next requests
+            self._replace_pool(pool)
+            raise
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+class Handler(BaseHTTPRequestHandler):
+    def _reply(self, status, body, content_type):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._reply(200, json.dumps(self.server.metrics.as_dict()), 'application/json')
+        else:
+            self._reply(404, 'not found\n', 'text/plain')
+
+    def do_POST(self):
+        if self.path != '/render':
+            self._reply(404, 'not found\n', 'text/plain')
+            return
+        metrics = self.server.metrics
+        with metrics.lock:
+            metrics.requests += 1
+            metrics.in_flight += 1
+        start = time.perf_counter()
+        result = None
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > self.server.max_body:
+                self._reply(413, f'specs are limited to {self.server.max_body} bytes\n', 'text/plain')
+                return
+            if length < 0:
+                raise ValueError('negative Content-Length')
+            spec = json.loads(self.rfile.read(length))
+            html,build_s,render_s = result = self.server.render(spec)
+            size = self._reply(200, html, 'text/html; charset=utf-8')
+        except (ValueError, TypeError, KeyError, AttributeError) as e: # malformed json or spec
+            self._reply(400, f'{type(e).__name__}: {e}\n', 'text/plain')
+        except TimeoutError:
+            self._reply(504, 'render timed out\n', 'text/plain')
+        except Exception as e:
+            self._reply(500, f'{type(e).__name__}: {e}\n', 'text/plain')
+        finally:
+            with metrics.lock:
+                metrics.in_flight -= 1
+                if result is None:
+                    metrics.errors += 1
+                else:
+                    metrics.bytes += size
+                    metrics.build_s += build_s
+                    metrics.render_s += render_s
+                    metrics.latencies.append(time.perf_counter() - start)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='desmospy')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='render JSON graph specs over HTTP')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8000)
+    serve.add_argument('--workers', type=int, default=None, help='worker processes (default: one per cpu)')
+    serve.add_argument('--timeout', type=float, default=30.0, help='seconds allowed per render (default: 30, 0 for no limit)')
+    serve.add_argument('--max-body', type=int, default=1<<20, help='largest spec accepted, in bytes (default: 1 MiB)')
+    serve.add_argument('--assets', default=None, help='directory caching the Desmos library, which pages then embed')
+    serve.add_argument('--quiet', action='store_true', help="don't log each request")
+    args = parser.parse_args(argv)
+
+    options = {'assets': args.assets, 'inline': True} if args.assets else {}
+    server = Server((args.host, args.port), workers=args.workers, timeout=args.timeout, options=options, max_body=args.max_body)
+    server.quiet = args.quiet
+    print(f'desmospy serving on http://{args.host}:{server.server_port} with {server.workers} workers', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()